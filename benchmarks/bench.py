@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+
+    Time every todo, auth and api_v1 endpoint through the test client against
+    a seeded dataset::
+
+        $ python -m benchmarks --users 50 --items 1000 --output results.json
+        $ python -m benchmarks --baseline results.json --threshold 0.2
+
+"""
+import json
+import time
+import tracemalloc
+
+import click
+from sqlalchemy import event
+
+from todoism import create_app
+from todoism.demo import claim_demo_account, fill_demo_pool
+from todoism.extensions import db
+from todoism.fakes import forge
+from todoism.loadtest import percentile
+from todoism.models import Item
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """Register a benchmark, the decorated function prepares a run and returns the request to time."""
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return decorator
+
+
+class Context(object):
+    """The clients and ids shared by the benchmarks."""
+
+    def __init__(self, app, username, item_id):
+        self.app = app
+        self.username = username
+        self.item_id = item_id
+        self.anonymous = app.test_client()
+        self.client = self.login()
+        response = app.test_client().post('/api/v1/oauth/token', data=dict(
+            grant_type='password', username=username, password='123'))
+        self.token = response.get_json()['access_token']
+        self.refresh_token = response.get_json()['refresh_token']
+        self.api = app.test_client()
+        self.headers = {'Authorization': 'Bearer ' + self.token}
+
+    def login(self):
+        client = self.app.test_client()
+        client.post('/login', json=dict(username=self.username, password='123'))
+        return client
+
+    def create_item(self):
+        response = self.api.post('/api/v1/user/items', json=dict(body='Benchmark item'), headers=self.headers)
+        return response.get_json()['id']
+
+    def completed_item(self):
+        """Leave exactly one completed item, so that clearing never deletes the shared item."""
+        self.api.patch('/api/v1/user/items', json=dict(done=False), headers=self.headers)
+        self.api.patch('/api/v1/user/items/%d' % self.create_item(), headers=self.headers)
+
+
+@benchmark('home.index')
+def home_index(ctx):
+    return lambda: ctx.anonymous.get('/')
+
+
+@benchmark('home.intro')
+def home_intro(ctx):
+    return lambda: ctx.anonymous.get('/intro')
+
+
+@benchmark('home.set_locale')
+def home_set_locale(ctx):
+    return lambda: ctx.anonymous.get('/set-locale/en_US')
+
+
+@benchmark('auth.login[GET]')
+def auth_login_page(ctx):
+    return lambda: ctx.anonymous.get('/login')
+
+
+@benchmark('auth.login[POST]')
+def auth_login(ctx):
+    client = ctx.app.test_client()
+    return lambda: client.post('/login', json=dict(username=ctx.username, password='123'))
+
+
+@benchmark('auth.register')
+def auth_register(ctx):
+    # top the pool up before every round, the request claims a pooled account
+    with ctx.app.app_context():
+        fill_demo_pool(1, ctx.app.config['BABEL_DEFAULT_LOCALE'])
+    return lambda: ctx.app.test_client().get('/register')
+
+
+@benchmark('auth.register[empty_pool]')
+def auth_register_empty_pool(ctx):
+    # drain the pool, the request creates an account and hashes its password
+    with ctx.app.app_context():
+        while claim_demo_account(ctx.app.config['BABEL_DEFAULT_LOCALE']) is not None:
+            pass
+        db.session.commit()
+    return lambda: ctx.app.test_client().get('/register')
+
+
+@benchmark('auth.logout')
+def auth_logout(ctx):
+    client = ctx.login()
+    return lambda: client.get('/logout')
+
+
+@benchmark('todo.app')
+def todo_app(ctx):
+    return lambda: ctx.client.get('/app')
+
+
+@benchmark('todo.items')
+def todo_items(ctx):
+    return lambda: ctx.client.get('/items?after=%d' % ctx.item_id)
+
+
+@benchmark('todo.new_item')
+def todo_new_item(ctx):
+    return lambda: ctx.client.post('/items/new', json=dict(body='Benchmark item'))
+
+
+@benchmark('todo.edit_item')
+def todo_edit_item(ctx):
+    return lambda: ctx.client.put('/item/%d/edit' % ctx.item_id, json=dict(body='Edited item'))
+
+
+@benchmark('todo.toggle_item')
+def todo_toggle_item(ctx):
+    return lambda: ctx.client.patch('/item/%d/toggle' % ctx.item_id)
+
+
+@benchmark('todo.delete_item')
+def todo_delete_item(ctx):
+    item_id = ctx.create_item()
+    return lambda: ctx.client.delete('/item/%d/delete' % item_id)
+
+
+@benchmark('todo.clear_items')
+def todo_clear_items(ctx):
+    ctx.completed_item()
+    return lambda: ctx.client.delete('/item/clear')
+
+
+@benchmark('todo.complete_items')
+def todo_complete_items(ctx):
+    ctx.client.patch('/items/activate')
+    return lambda: ctx.client.patch('/items/complete')
+
+
+@benchmark('todo.activate_items')
+def todo_activate_items(ctx):
+    ctx.client.patch('/items/complete')
+    return lambda: ctx.client.patch('/items/activate')
+
+
+@benchmark('api_v1.index')
+def api_index(ctx):
+    return lambda: ctx.api.get('/api/v1/')
+
+
+@benchmark('api_v1.token[password]')
+def api_token(ctx):
+    return lambda: ctx.api.post('/api/v1/oauth/token', data=dict(
+        grant_type='password', username=ctx.username, password='123'))
+
+
+@benchmark('api_v1.token[refresh_token]')
+def api_refresh_token(ctx):
+    return lambda: ctx.api.post('/api/v1/oauth/token', data=dict(
+        grant_type='refresh_token', refresh_token=ctx.refresh_token))
+
+
+@benchmark('api_v1.revoke_token')
+def api_revoke_token(ctx):
+    return lambda: ctx.api.post('/api/v1/oauth/revoke', data=dict(token='unknown'))
+
+
+@benchmark('api_v1.user')
+def api_user(ctx):
+    return lambda: ctx.api.get('/api/v1/user', headers=ctx.headers)
+
+
+@benchmark('api_v1.items[page]')
+def api_items_page(ctx):
+    return lambda: ctx.api.get('/api/v1/user/items?page=3', headers=ctx.headers)
+
+
+@benchmark('api_v1.items[cursor]')
+def api_items_cursor(ctx):
+    return lambda: ctx.api.get('/api/v1/user/items?cursor=', headers=ctx.headers)
+
+
+@benchmark('api_v1.items[POST]')
+def api_new_item(ctx):
+    return lambda: ctx.api.post('/api/v1/user/items', json=dict(body='Benchmark item'), headers=ctx.headers)
+
+
+@benchmark('api_v1.items[PATCH]')
+def api_mark_items(ctx):
+    return lambda: ctx.api.patch('/api/v1/user/items', json=dict(done=False), headers=ctx.headers)
+
+
+@benchmark('api_v1.active_items')
+def api_active_items(ctx):
+    return lambda: ctx.api.get('/api/v1/user/items/active', headers=ctx.headers)
+
+
+@benchmark('api_v1.completed_items')
+def api_completed_items(ctx):
+    return lambda: ctx.api.get('/api/v1/user/items/completed', headers=ctx.headers)
+
+
+@benchmark('api_v1.completed_items[DELETE]')
+def api_clear_items(ctx):
+    ctx.completed_item()
+    return lambda: ctx.api.delete('/api/v1/user/items/completed', headers=ctx.headers)
+
+
+@benchmark('api_v1.item[GET]')
+def api_item(ctx):
+    return lambda: ctx.api.get('/api/v1/user/items/%d' % ctx.item_id, headers=ctx.headers)
+
+
+@benchmark('api_v1.item[PUT]')
+def api_edit_item(ctx):
+    return lambda: ctx.api.put('/api/v1/user/items/%d' % ctx.item_id, json=dict(body='Edited item'),
+                               headers=ctx.headers)
+
+
+@benchmark('api_v1.item[PATCH]')
+def api_toggle_item(ctx):
+    return lambda: ctx.api.patch('/api/v1/user/items/%d' % ctx.item_id, headers=ctx.headers)
+
+
+@benchmark('api_v1.item[DELETE]')
+def api_delete_item(ctx):
+    item_id = ctx.create_item()
+    return lambda: ctx.api.delete('/api/v1/user/items/%d' % item_id, headers=ctx.headers)
+
+
+@benchmark('api_v1.item_changes')
+def api_item_changes(ctx):
+    return lambda: ctx.api.get('/api/v1/user/items/changes?since=1', headers=ctx.headers)
+
+
+@benchmark('api_v1.items_export')
+def api_items_export(ctx):
+    return lambda: ctx.api.get('/api/v1/user/items/export', headers=ctx.headers)
+
+
+@benchmark('api_v1.items_import')
+def api_items_import(ctx):
+    data = '\n'.join(json.dumps(dict(body='Imported item %d' % i)) for i in range(100))
+    headers = dict(ctx.headers, **{'Content-Type': 'application/x-ndjson'})
+    return lambda: ctx.api.post('/api/v1/user/items/import', data=data, headers=headers)
+
+
+@benchmark('api_v1.items_batch')
+def api_items_batch(ctx):
+    operations = [dict(op='create', body='Batch item'), dict(op='toggle', id=ctx.item_id),
+                  dict(op='update', id=ctx.item_id, body='Batch edit')]
+    return lambda: ctx.api.post('/api/v1/user/items/batch', json=dict(operations=operations), headers=ctx.headers)
+
+
+def run_benchmark(ctx, engine, prepare, repeat):
+    queries = []
+
+    def count_query(*args):
+        queries.append(1)
+
+    timings = []
+    query_counts = []
+    errors = 0
+    for i in range(repeat):
+        request = prepare(ctx)
+        del queries[:]
+        event.listen(engine, 'before_cursor_execute', count_query)
+        try:
+            start = time.perf_counter()
+            response = request()
+            response.get_data()  # streamed bodies are produced while they are read
+            response.close()
+            timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            event.remove(engine, 'before_cursor_execute', count_query)
+        query_counts.append(len(queries))
+        errors += response.status_code >= 400
+
+    # allocations are traced in a separate run, tracing slows everything down
+    request = prepare(ctx)
+    tracemalloc.start()
+    try:
+        response = request()
+        response.get_data()
+        response.close()
+        allocated, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'p50': round(percentile(timings, 50), 3),
+        'p95': round(percentile(timings, 95), 3),
+        'p99': round(percentile(timings, 99), 3),
+        'queries': max(query_counts),
+        'allocated_kb': round(allocated / 1024.0, 1),
+        'peak_kb': round(peak / 1024.0, 1),
+        'errors': errors,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return the regressions of the results against a baseline, as printable lines."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ('p50', 'p95', 'p99'):
+            if result[metric] > base[metric] * (1 + threshold):
+                regressions.append('%s: %s %.3f ms, baseline %.3f ms' % (name, metric, result[metric], base[metric]))
+        if result['queries'] > base['queries']:
+            regressions.append('%s: %d queries, baseline %d' % (name, result['queries'], base['queries']))
+    return regressions
+
+
+@click.command()
+@click.option('--users', default=20, help='Forged users.')
+@click.option('--items', default=500, help='Items per forged user.')
+@click.option('--repeat', default=50, help='Timed requests per endpoint.')
+@click.option('--database', default='sqlite:///', help='Database URI, an in-memory SQLite by default.')
+@click.option('--only', help='Only run the benchmarks whose name contains this string.')
+@click.option('--output', type=click.Path(), help='Write the results to this JSON file.')
+@click.option('--baseline', type=click.Path(exists=True), help='Compare with the results in this JSON file.')
+@click.option('--threshold', default=0.2, help='Allowed slowdown against the baseline, 0.2 is 20%.')
+def main(users, items, repeat, database, only, output, baseline, threshold):
+    """Benchmark every endpoint against a seeded dataset."""
+    app = create_app('benchmark')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database
+    with app.app_context():
+        db.create_all()
+        click.echo('Forging %d users with %d items each...' % (users, items))
+        user_ids = forge(users, items)
+        username = 'forge%d' % user_ids[0]
+        item_id = db.session.query(db.func.min(Item.id)).filter_by(author_id=user_ids[0]).scalar()
+        engine = db.engine
+
+    # requests run outside of an app context, so every request gets a fresh session as in production
+    results = {}
+    try:
+        ctx = Context(app, username, item_id)
+        for name, prepare in BENCHMARKS:
+            if only and only not in name:
+                continue
+            results[name] = result = run_benchmark(ctx, engine, prepare, repeat)
+            click.echo('%-32s p50 %8.2f  p95 %8.2f  p99 %8.2f ms  %3d queries  %8.1f KB peak%s' % (
+                name, result['p50'], result['p95'], result['p99'], result['queries'], result['peak_kb'],
+                '  %d errors' % result['errors'] if result['errors'] else ''))
+    finally:
+        app.extensions['todoism_password_hasher'].shutdown()
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), threshold)
+        for line in regressions:
+            click.echo('REGRESSION ' + line)
+        if regressions:
+            raise SystemExit(1)
@@ -13,7 +13,7 @@ app = create_app('testing')
 with app.app_context():
     db.create_all()
 
-    user = User(username='grey')
+    user = User(username='grey', all_item_count=4, active_item_count=3, completed_item_count=1)
     user.set_password('123')
     db.session.add(user)
 
@@ -5,12 +5,19 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
+import csv
+import gzip
+import io
+import json
+import os
 import unittest
+from datetime import datetime, timedelta
 
 from flask import url_for
+from sqlalchemy import event
 
 from todoism import create_app, db
-from todoism.models import User, Item
+from todoism.models import User, Item, Tombstone
 
 
 class APITestCase(unittest.TestCase):
@@ -108,6 +115,11 @@ class APITestCase(unittest.TestCase):
         response = self.client.put(url_for('api_v1.item', item_id=2), json=dict(body='New Item Body'),
                                    headers=self.set_auth_headers(token))
         self.assertEqual(response.status_code, 403)
+        self.assertEqual(Item.query.get(2).body, 'Test Item 2')
+
+        response = self.client.put(url_for('api_v1.item', item_id=42), json=dict(body='New Item Body'),
+                                   headers=self.set_auth_headers(token))
+        self.assertEqual(response.status_code, 404)
 
     def test_delete_item(self):
         token = self.get_oauth_token()
@@ -162,6 +174,11 @@ class APITestCase(unittest.TestCase):
         self.assertIn('author', data)
         self.assertEqual(data['id'], 1)
 
+        response = self.client.get(url_for('api_v1.item', item_id=2), headers=self.set_auth_headers(token))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(url_for('api_v1.item', item_id=42), headers=self.set_auth_headers(token))
+        self.assertEqual(response.status_code, 404)
+
     def test_get_items(self):
         user = User.query.get(1)
         item2 = Item(body='Test Item 2', author=user)
@@ -209,3 +226,539 @@ class APITestCase(unittest.TestCase):
         response = self.client.delete(url_for('api_v1.index'))
         data = response.get_json()
         self.assertEqual(data['message'], 'The method is not allowed for the requested URL.')
+
+    def test_user_item_counts(self):
+        token = self.get_oauth_token()
+        self.client.post(url_for('api_v1.items'), json=dict(body='Buy milk'), headers=self.set_auth_headers(token))
+        self.client.post(url_for('api_v1.items'), json=dict(body='Buy eggs'), headers=self.set_auth_headers(token))
+        self.client.patch(url_for('api_v1.item', item_id=3), headers=self.set_auth_headers(token))
+
+        response = self.client.get(url_for('api_v1.user'), headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual(data['all_item_count'], 2)
+        self.assertEqual(data['active_item_count'], 1)
+        self.assertEqual(data['completed_item_count'], 1)
+
+        self.client.delete(url_for('api_v1.completed_items'), headers=self.set_auth_headers(token))
+        response = self.client.get(url_for('api_v1.user'), headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual(data['all_item_count'], 1)
+        self.assertEqual(data['completed_item_count'], 0)
+
+    def test_get_items_with_cursor(self):
+        user = User.query.get(1)
+        for i in range(25):
+            Item(body='Item %d' % i, author=user, done=i % 2 == 0)
+        db.session.commit()
+        user.all_item_count = 26
+        db.session.commit()
+
+        token = self.get_oauth_token()
+        response = self.client.get(url_for('api_v1.items', cursor=''), headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['items']), 20)
+        self.assertIsNone(data['prev'])
+        self.assertIsNotNone(data['next'])
+        self.assertNotIn('count', data)
+        ids = [item['id'] for item in data['items']]
+
+        response = self.client.get(data['next'], headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual(len(data['items']), 6)
+        self.assertIsNone(data['next'])
+        self.assertEqual(data['items'][0]['id'], ids[-1] + 1)
+
+        response = self.client.get(data['prev'], headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual([item['id'] for item in data['items']], ids)
+        self.assertIsNone(data['prev'])
+
+        response = self.client.get(url_for('api_v1.completed_items', cursor='', count='true'),
+                                   headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual(len(data['items']), 13)
+        self.assertTrue(all(item['done'] for item in data['items']))
+        self.assertIn('count', data)
+
+        response = self.client.get(url_for('api_v1.items', cursor='bad-cursor'), headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['message'], 'The cursor was invalid.')
+
+    def test_batch_items(self):
+        user = User.query.get(1)
+        user.all_item_count = user.active_item_count = 1
+        db.session.commit()
+
+        token = self.get_oauth_token()
+        operations = [
+            dict(op='create', body='Buy milk'),
+            dict(op='update', id=1, body='New Item Body'),
+            dict(op='toggle', id=1),
+            dict(op='delete', id=2),
+        ]
+        response = self.client.post(url_for('api_v1.items_batch'), json=dict(operations=operations),
+                                    headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([result['status'] for result in data['results']], [424, 424, 424, 403])
+        self.assertEqual(data['results'][0]['message'], 'Not applied, the batch was rolled back.')
+        self.assertEqual(Item.query.get(1).body, 'Test Item')
+        self.assertEqual(Item.query.count(), 2)
+
+        response = self.client.post(url_for('api_v1.items_batch'),
+                                    json=dict(operations=operations, mode='best_effort'),
+                                    headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in data['results']], [201, 204, 204, 403])
+        item = Item.query.get(data['results'][0]['id'])
+        self.assertEqual(item.body, 'Buy milk')
+        self.assertEqual(Item.query.get(1).body, 'New Item Body')
+        self.assertTrue(Item.query.get(1).done)
+        self.assertIsNotNone(Item.query.get(2))
+
+        operations = [dict(op='toggle', id=1), dict(op='delete', id=1), dict(op='toggle', id=1)]
+        response = self.client.post(url_for('api_v1.items_batch'),
+                                    json=dict(operations=operations, mode='best_effort'),
+                                    headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual([result['status'] for result in data['results']], [204, 204, 404])
+        self.assertIsNone(Item.query.get(1))
+
+        self.assertEqual((user.all_item_count, user.active_item_count, user.completed_item_count), (1, 1, 0))
+
+        response = self.client.post(url_for('api_v1.items_batch'), json=dict(operations=[dict(op='create')]),
+                                    headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['results'][0]['message'], 'The item body was empty or invalid.')
+
+        # JSON booleans are not item ids, true must not address item 1
+        item_id = Item.query.filter_by(body='Buy milk').one().id
+        operations = [dict(op='toggle', id=True), dict(op='toggle', id=item_id), dict(op='toggle', id=item_id),
+                      dict(op='toggle', id=item_id)]
+        response = self.client.post(url_for('api_v1.items_batch'),
+                                    json=dict(operations=operations, mode='best_effort'),
+                                    headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual([result['status'] for result in data['results']], [404, 204, 204, 204])
+        self.assertIs(data['results'][0]['id'], True)
+        self.assertTrue(Item.query.get(item_id).done)
+        db.session.refresh(user)
+        self.assertEqual((user.all_item_count, user.active_item_count, user.completed_item_count), (1, 0, 1))
+
+        # bodies must be strings, creates get their ids in order
+        operations = [dict(op='create', body=['a']), dict(op='update', id=item_id, body={'a': 1}),
+                      dict(op='create', body='First'), dict(op='create', body='Second')]
+        statements = []
+
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+        try:
+            response = self.client.post(url_for('api_v1.items_batch'),
+                                        json=dict(operations=operations, mode='best_effort'),
+                                        headers=self.set_auth_headers(token))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_query)
+        self.assertEqual(len([statement for statement in statements if statement.startswith('INSERT INTO item')]), 1)
+        data = response.get_json()
+        self.assertEqual([result['status'] for result in data['results']], [400, 400, 201, 201])
+        self.assertEqual(Item.query.get(data['results'][2]['id']).body, 'First')
+        self.assertEqual(Item.query.get(data['results'][3]['id']).body, 'Second')
+        self.assertEqual(Item.query.get(item_id).body, 'Buy milk')
+
+    def test_mark_items(self):
+        token = self.get_oauth_token()
+        response = self.client.patch(url_for('api_v1.items'), json=dict(done=True),
+                                     headers=self.set_auth_headers(token))
+        self.assertEqual(response.status_code, 204)
+        self.assertTrue(Item.query.get(1).done)
+        self.assertFalse(Item.query.get(2).done)
+
+        response = self.client.patch(url_for('api_v1.items'), json=dict(done=False),
+                                     headers=self.set_auth_headers(token))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Item.query.get(1).done)
+
+        response = self.client.patch(url_for('api_v1.items'), json=dict(done='yes'),
+                                     headers=self.set_auth_headers(token))
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_items_fields(self):
+        token = self.get_oauth_token()
+        response = self.client.get(url_for('api_v1.items', fields='id,body,done'),
+                                   headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['items'], [dict(id=1, body='Test Item', done=False)])
+
+        response = self.client.get(url_for('api_v1.item', item_id=1), headers=self.set_auth_headers(token))
+        data = response.get_json()
+        self.assertEqual(data['author']['id'], 1)
+        self.assertEqual(data['author']['username'], 'grey')
+        self.assertEqual(data['self'], url_for('api_v1.item', item_id=1, _external=True))
+
+        response = self.client.get(url_for('api_v1.items', fields='id,password'), headers=self.set_auth_headers(token))
+        self.assertEqual(response.status_code, 400)
+
+    def test_get_items_query_count(self):
+        user = User.query.get(1)
+        for i in range(50):
+            Item(body='Item %d' % i, author=user)
+        db.session.commit()
+        token = self.get_oauth_token()
+
+        statements = []
+
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+        try:
+            counts = []
+            for per_page in (5, 50):
+                del statements[:]
+                db.session.expire_all()
+                response = self.client.get(url_for('api_v1.items', per_page=per_page),
+                                           headers=self.set_auth_headers(token))
+                self.assertEqual(len(response.get_json()['items']), per_page)
+                counts.append(len(statements))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_query)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_conditional_get(self):
+        token = self.get_oauth_token()
+        headers = self.set_auth_headers(token)
+        response = self.client.get(url_for('api_v1.items'), headers=headers)
+        etag = response.headers['ETag']
+        self.assertIsNotNone(response.headers.get('Last-Modified'))
+
+        statements = []
+
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+        try:
+            response = self.client.get(url_for('api_v1.items'), headers=dict(headers, **{'If-None-Match': etag}))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_query)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([statement for statement in statements if 'FROM item' in statement])
+
+        self.client.patch(url_for('api_v1.item', item_id=1), headers=headers)
+        response = self.client.get(url_for('api_v1.items'), headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        response = self.client.get(url_for('api_v1.user'), headers=headers)
+        etag = response.headers['ETag']
+        response = self.client.get(url_for('api_v1.user'), headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+
+        # a guessed etag doesn't hide a missing or foreign item
+        response = self.client.get(url_for('api_v1.item', item_id=999), headers=dict(headers, **{
+            'If-None-Match': '"item-999-0"'}))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(url_for('api_v1.item', item_id=2), headers=dict(headers, **{
+            'If-None-Match': '"item-2-%d"' % User.query.get(1).item_version}))
+        self.assertEqual(response.status_code, 403)
+
+    def test_if_modified_since_same_second(self):
+        token = self.get_oauth_token()
+        headers = self.set_auth_headers(token)
+        user = User.query.get(1)
+        user.items_updated_at = datetime(2018, 1, 1, 12, 0, 0, 100000)
+        db.session.commit()
+        response = self.client.get(url_for('api_v1.items'), headers=headers)
+        last_modified = response.headers['Last-Modified']
+        response = self.client.get(url_for('api_v1.items'), headers=dict(headers, **{
+            'If-Modified-Since': last_modified}))
+        self.assertEqual(response.status_code, 200)
+
+        # a change made in the same second as the last fetch
+        self.client.post(url_for('api_v1.items'), json=dict(body='Same second'), headers=headers)
+        user = User.query.get(1)
+        user.items_updated_at = datetime(2018, 1, 1, 12, 0, 0, 900000)
+        db.session.commit()
+        response = self.client.get(url_for('api_v1.items'), headers=dict(headers, **{
+            'If-Modified-Since': last_modified}))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Same second', response.get_data(as_text=True))
+
+        user = User.query.get(1)
+        user.items_updated_at = datetime(2018, 1, 1, 12, 0, 0)
+        db.session.commit()
+        response = self.client.get(url_for('api_v1.items'), headers=dict(headers, **{
+            'If-Modified-Since': last_modified}))
+        self.assertEqual(response.status_code, 304)
+
+    def test_conditional_update(self):
+        token = self.get_oauth_token()
+        headers = self.set_auth_headers(token)
+        response = self.client.get(url_for('api_v1.item', item_id=1), headers=headers)
+        etag = response.headers['ETag']
+
+        response = self.client.get(url_for('api_v1.item', item_id=1), headers=dict(headers, **{'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.put(url_for('api_v1.item', item_id=1), json=dict(body='New Item Body'),
+                                   headers=dict(headers, **{'If-Match': etag}))
+        self.assertEqual(response.status_code, 204)
+        new_etag = response.headers['ETag']
+
+        response = self.client.patch(url_for('api_v1.item', item_id=1), headers=dict(headers, **{'If-Match': etag}))
+        data = response.get_json()
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(data['message'], 'The item was changed since the given version.')
+        self.assertFalse(Item.query.get(1).done)
+
+        response = self.client.delete(url_for('api_v1.item', item_id=1),
+                                      headers=dict(headers, **{'If-Match': new_etag}))
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(Item.query.get(1))
+
+    def test_item_changes(self):
+        token = self.get_oauth_token()
+        headers = self.set_auth_headers(token)
+        response = self.client.get(url_for('api_v1.item_changes', since=0), headers=headers)
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['version'], 0)
+        self.assertEqual((data['items'], data['deleted']), ([], []))
+
+        self.client.post(url_for('api_v1.items'), json=dict(body='Buy milk'), headers=headers)
+        self.client.post(url_for('api_v1.items'), json=dict(body='Buy eggs'), headers=headers)
+        response = self.client.get(url_for('api_v1.item_changes', since=0), headers=headers)
+        data = response.get_json()
+        self.assertEqual(data['version'], 2)
+        self.assertEqual([item['body'] for item in data['items']], ['Buy milk', 'Buy eggs'])
+
+        since = data['version']
+        self.client.patch(url_for('api_v1.item', item_id=3), headers=headers)
+        self.client.delete(url_for('api_v1.item', item_id=4), headers=headers)
+        self.client.delete(url_for('api_v1.item', item_id=1), headers=headers)
+        response = self.client.get(url_for('api_v1.item_changes', since=since), headers=headers)
+        data = response.get_json()
+        self.assertEqual(data['version'], 5)
+        self.assertEqual([(item['id'], item['done']) for item in data['items']], [(3, True)])
+        self.assertEqual(data['deleted'], [4, 1])
+
+        self.client.delete(url_for('api_v1.completed_items'), headers=headers)
+        response = self.client.get(url_for('api_v1.item_changes', since=5), headers=headers)
+        data = response.get_json()
+        self.assertEqual((data['items'], data['deleted']), ([], [3]))
+
+        response = self.client.get(url_for('api_v1.item_changes'), headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+    def committed_changes(self):
+        """Items and tombstones stamped with the current version, after checking that nothing is newer."""
+        db.session.expire_all()
+        version = User.query.get(1).item_version
+        self.assertEqual(Item.query.filter(Item.author_id == 1, Item.version > version).count(), 0)
+        self.assertEqual(Tombstone.query.filter(Tombstone.author_id == 1, Tombstone.version > version).count(), 0)
+        return ({item.id for item in Item.query.filter_by(author_id=1, version=version)},
+                {tombstone.item_id for tombstone in Tombstone.query.filter_by(author_id=1, version=version)})
+
+    def test_changes_stamped_with_committed_version(self):
+        headers = self.set_auth_headers(self.get_oauth_token())
+        self.client.post(url_for('api_v1.items'), json=dict(body='Buy milk'), headers=headers)
+        self.assertEqual(self.committed_changes(), ({3}, set()))
+        self.client.patch(url_for('api_v1.item', item_id=3), headers=headers)
+        self.assertEqual(self.committed_changes(), ({3}, set()))
+        self.client.put(url_for('api_v1.item', item_id=1), json=dict(body='Buy eggs'), headers=headers)
+        self.assertEqual(self.committed_changes(), ({1}, set()))
+        self.client.patch(url_for('api_v1.items'), json=dict(done=True), headers=headers)
+        self.assertEqual(self.committed_changes(), ({1}, set()))
+        self.client.post(url_for('api_v1.items_batch'), json=dict(operations=[
+            dict(op='create', body='Buy bread'), dict(op='toggle', id=3)]), headers=headers)
+        self.assertEqual(self.committed_changes(), ({3, 4}, set()))
+        self.client.post(url_for('api_v1.items_import'), data='{"body": "Buy tea"}\n',
+                         headers=dict(headers, **{'Content-Type': 'application/x-ndjson'}))
+        self.assertEqual(self.committed_changes(), ({5}, set()))
+        self.client.delete(url_for('api_v1.item', item_id=4), headers=headers)
+        self.assertEqual(self.committed_changes(), (set(), {4}))
+        self.client.delete(url_for('api_v1.completed_items'), headers=headers)
+        self.assertEqual(self.committed_changes(), (set(), {1}))
+
+        # the user row is bumped, and locked, before any item is changed
+        statements = []
+
+        def record_write(conn, cursor, statement, parameters, context, executemany):
+            if statement.split(None, 1)[0] in ('INSERT', 'UPDATE', 'DELETE'):
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record_write)
+        try:
+            self.client.patch(url_for('api_v1.item', item_id=3), headers=headers)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record_write)
+        self.assertTrue(statements[0].startswith('UPDATE user SET item_version='))
+        self.assertIn('UPDATE item', statements[1])
+
+    def test_compact_tombstones(self):
+        token = self.get_oauth_token()
+        headers = self.set_auth_headers(token)
+        self.client.delete(url_for('api_v1.item', item_id=1), headers=headers)
+        self.assertEqual(Tombstone.query.count(), 1)
+
+        runner = self.client.application.test_cli_runner()
+        result = runner.invoke(args=['compact'])
+        self.assertIn('Compacted 0 tombstone(s).', result.output)
+        result = runner.invoke(args=['compact', '--days', '-1'])
+        self.assertIn('Compacted 1 tombstone(s).', result.output)
+        self.assertEqual(User.query.get(1).compacted_version, 1)
+
+        response = self.client.get(url_for('api_v1.item_changes', since=0), headers=headers)
+        self.assertEqual(response.status_code, 410)
+        response = self.client.get(url_for('api_v1.item_changes', since=1), headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+    def test_refresh_token(self):
+        response = self.client.post(url_for('api_v1.token'), data=dict(
+            grant_type='password',
+            username='grey',
+            password='123'
+        ))
+        refresh_token = response.get_json()['refresh_token']
+
+        response = self.client.post(url_for('api_v1.token'), data=dict(grant_type='refresh_token',
+                                                                       refresh_token=refresh_token))
+        data = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('refresh_token', data)
+        response = self.client.get(url_for('api_v1.user'), headers=self.set_auth_headers(data['access_token']))
+        self.assertEqual(response.get_json()['username'], 'grey')
+
+        response = self.client.post(url_for('api_v1.token'), data=dict(grant_type='refresh_token',
+                                                                       refresh_token=refresh_token + 'x'))
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(url_for('api_v1.revoke_token'), data=dict(token=refresh_token))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(url_for('api_v1.token'), data=dict(grant_type='refresh_token',
+                                                                       refresh_token=refresh_token))
+        data = response.get_json()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(data['message'], 'The refresh token was invalid, expired or revoked.')
+
+        result = self.client.application.test_cli_runner().invoke(args=['purge-tokens'])
+        self.assertIn('Purged 1 refresh token(s).', result.output)
+
+    def test_expired_account(self):
+        response = self.client.post(url_for('api_v1.token'), data=dict(
+            grant_type='password',
+            username='grey',
+            password='123'
+        ))
+        data = response.get_json()
+        response = self.client.get(url_for('api_v1.user'), headers=self.set_auth_headers(data['access_token']))
+        self.assertEqual(response.status_code, 200)
+
+        User.query.filter_by(username='grey').first().expires_at = datetime.utcnow() - timedelta(minutes=1)
+        db.session.commit()
+        # the first request caches the identity again, the second one is served from the cache
+        for i in range(2):
+            response = self.client.get(url_for('api_v1.user'), headers=self.set_auth_headers(data['access_token']))
+            self.assertEqual(response.status_code, 401)
+        response = self.client.post(url_for('api_v1.token'), data=dict(grant_type='refresh_token',
+                                                                       refresh_token=data['refresh_token']))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url_for('api_v1.token'), data=dict(
+            grant_type='password',
+            username='grey',
+            password='123'
+        ))
+        self.assertEqual(response.status_code, 400)
+
+    def test_export_items(self):
+        user = User.query.get(1)
+        db.session.add_all([Item(body='Item, with "quotes"', author=user, done=True), Item(body='中文', author=user)])
+        db.session.commit()
+        token = self.get_oauth_token()
+
+        response = self.client.get(url_for('api_v1.items_export'), headers=self.set_auth_headers(token))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(lines, [dict(id=1, body='Test Item', done=False),
+                                 dict(id=3, body='Item, with "quotes"', done=True),
+                                 dict(id=4, body='中文', done=False)])
+
+        response = self.client.get(url_for('api_v1.items_export', format='csv', done='true'),
+                                   headers=self.set_auth_headers(token))
+        self.assertEqual(response.mimetype, 'text/csv')
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual(rows, [['id', 'body', 'done'], ['3', 'Item, with "quotes"', 'True']])
+
+        headers = self.set_auth_headers(token)
+        headers['Accept-Encoding'] = 'gzip'
+        response = self.client.get(url_for('api_v1.items_export', done='false'), headers=headers)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        lines = gzip.decompress(response.data).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [1, 4])
+
+        response = self.client.get(url_for('api_v1.items_export', format='xml'), headers=self.set_auth_headers(token))
+        self.assertEqual(response.status_code, 400)
+
+    def test_import_items(self):
+        token = self.get_oauth_token()
+        headers = self.set_auth_headers(token)
+        headers['Content-Type'] = 'application/x-ndjson'
+        data = '\n'.join([
+            json.dumps(dict(body='Item 1')),
+            json.dumps(dict(body='Item 2', done=True)),
+            '',
+            'not json',
+            json.dumps(dict(body='')),
+            json.dumps(dict(body='Item 3', done='maybe')),
+            json.dumps(dict(id=42, body='中文', done=False)),
+        ])
+        self.client.application.config['TODOISM_IMPORT_BATCH_SIZE'] = 2
+        response = self.client.post(url_for('api_v1.items_import'), data=data.encode('utf-8'), headers=headers)
+        result = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(result['imported'], 3)
+        self.assertEqual(result['failed'], 3)
+        self.assertEqual([error['line'] for error in result['errors']], [4, 5, 6])
+        self.assertEqual(result['errors'][2]['message'], 'The done field must be true or false.')
+
+        user = User.query.get(1)
+        self.assertEqual([(item.body, item.done) for item in Item.query.with_parent(user).order_by(Item.id)],
+                         [('Test Item', False), ('Item 1', False), ('Item 2', True), ('中文', False)])
+        # the fixture item is not counted by the fixture, the counters only moved by the imported items
+        self.assertEqual((user.all_item_count, user.active_item_count, user.completed_item_count), (3, 2, 1))
+
+        headers['Content-Type'] = 'text/csv'
+        headers['Content-Encoding'] = 'gzip'
+        data = gzip.compress('id,body,done\r\n1,"Multi\nline, item",True\r\n2,,False\r\n'.encode('utf-8'))
+        response = self.client.post(url_for('api_v1.items_import'), data=data, headers=headers)
+        result = response.get_json()
+        self.assertEqual((result['imported'], result['failed']), (1, 1))
+        self.assertEqual(result['errors'], [dict(line=4, message='The item body was empty or invalid.')])
+        self.assertEqual(Item.query.order_by(Item.id.desc()).first().body, 'Multi\nline, item')
+
+        # truncated and corrupt gzip bodies
+        for data in (data[:-12], data[:10] + b'\xff' * 20 + data[30:]):
+            response = self.client.post(url_for('api_v1.items_import'), data=data, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['errors'][-1]['message'],
+                             'The request body could not be read from this line on.')
+
+        # the read error is capped like the line errors
+        data = gzip.compress(('not json\n' * 100 + os.urandom(1000).hex()).encode('utf-8'))[:-12]
+        response = self.client.post(url_for('api_v1.items_import', format='ndjson'), data=data, headers=headers)
+        result = response.get_json()
+        self.assertEqual(result['failed'], 101)
+        self.assertEqual(len(result['errors']), 100)
+
+        response = self.client.post(url_for('api_v1.items_import', format='csv'), data=b'title\r\nItem',
+                                    headers=self.set_auth_headers(token))
+        self.assertEqual(response.get_json()['errors'],
+                         [dict(line=1, message='The CSV header must have a body column.')])
@@ -6,17 +6,21 @@
     :license: MIT, see LICENSE for more details.
 """
 import unittest
+from datetime import datetime, timedelta
 
 from flask import url_for
 
 from todoism import create_app, db
-from todoism.models import User
+from todoism.demo import fill_demo_pool
+from todoism.models import User, Item
+from todoism.passwords import PasswordHasher, HashingBusy
 
 
 class AuthTestCase(unittest.TestCase):
 
     def setUp(self):
         app = create_app('testing')
+        self.app = app
         self.app_context = app.test_request_context()
         self.app_context.push()
         db.create_all()
@@ -67,3 +71,101 @@ class AuthTestCase(unittest.TestCase):
         self.assertIn('password', data)
         self.assertIn(data['message'], 'Generate success.')
         self.assertIsNotNone(User.query.filter_by(username=data['username']))
+
+        user = User.query.filter_by(username=data['username']).first()
+        self.assertEqual(Item.query.with_parent(user).count(), 4)
+        self.assertEqual((user.all_item_count, user.active_item_count, user.completed_item_count), (4, 3, 1))
+        self.assertTrue(user.validate_password(data['password']))
+        self.assertGreater(user.expires_at, datetime.utcnow())
+
+    def test_expired_account_login(self):
+        user = User.query.get(1)
+        user.expires_at = datetime.utcnow() - timedelta(minutes=1)
+        db.session.commit()
+        response = self.client.post(url_for('auth.login'), json=dict(username='grey', password='123'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_expired_account_session(self):
+        self.client.post(url_for('auth.login'), json=dict(username='grey', password='123'))
+        response = self.client.get(url_for('todo.app'))
+        self.assertEqual(response.status_code, 200)
+        User.query.filter_by(username='grey').first().expires_at = datetime.utcnow() - timedelta(minutes=1)
+        db.session.commit()
+        for i in range(2):
+            response = self.client.get(url_for('todo.app'))
+            self.assertNotEqual(response.status_code, 200)
+
+    def test_claim_pooled_account(self):
+        self.assertEqual(fill_demo_pool(2, 'en_US'), 2)
+        self.assertEqual(fill_demo_pool(2, 'en_US'), 0)
+        pooled = {user.username for user in User.query.filter_by(pool_locale='en_US')}
+
+        response = self.client.get(url_for('auth.register'))
+        data = response.get_json()
+        self.assertIn(data['username'], pooled)
+        user = User.query.filter_by(username=data['username']).first()
+        self.assertIsNone(user.pool_locale)
+        self.assertIsNone(user.demo_password)
+        self.assertIsNotNone(user.expires_at)
+        self.assertEqual(User.query.filter_by(pool_locale='en_US').count(), 1)
+
+        response = self.client.post(url_for('auth.login'), json=dict(username=data['username'],
+                                                                    password=data['password']))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url_for('todo.app'))
+        self.assertIn('Witness something truly majestic', response.get_data(as_text=True))
+
+    def test_pooled_account_locale(self):
+        fill_demo_pool(1, 'zh_Hans_CN')
+        self.client.set_cookie('localhost', 'locale', 'zh_Hans_CN')
+        response = self.client.get(url_for('auth.register'))
+        data = response.get_json()
+        user = User.query.filter_by(username=data['username']).first()
+        self.assertIsNone(user.pool_locale)
+        self.assertIn('看见真正雄伟的景色', [item.body for item in user.items])
+
+    def test_password_hash_upgrade(self):
+        user = User.query.get(1)
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:1000$'))
+
+        self.app.extensions['todoism_password_hasher'] = PasswordHasher('pbkdf2:sha256:2000')
+        response = self.client.post(url_for('auth.login'), json=dict(username='grey', password='123'))
+        self.assertEqual(response.status_code, 200)
+        user = User.query.get(1)
+        self.assertTrue(user.password_hash.startswith('pbkdf2:sha256:2000$'))
+        self.assertTrue(user.validate_password('123'))
+
+    def test_password_hash_default_iterations(self):
+        hasher = PasswordHasher('pbkdf2:sha256')
+        password_hash = hasher.hash('123')
+        self.assertTrue(password_hash.startswith('pbkdf2:sha256:150000$'))
+        self.assertFalse(hasher.needs_rehash(password_hash))
+        self.assertTrue(PasswordHasher('pbkdf2:sha256:2000').needs_rehash(password_hash))
+
+    def test_hashing_pool(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1, timeout=10)
+        password_hash = hasher.hash('123')
+        self.assertTrue(hasher.verify(password_hash, '123'))
+        self.assertFalse(hasher.verify(password_hash, '456'))
+
+    def test_hashing_timeout_keeps_slot(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000000', workers=1, timeout=0.01)
+        try:
+            with self.assertRaises(HashingBusy):
+                hasher.hash('123')
+            # the timed out call still runs in the pool, so its slot is still taken
+            self.assertFalse(hasher._slots.acquire(blocking=False))
+            self.assertTrue(hasher._slots.acquire(timeout=30))
+            hasher._slots.release()
+        finally:
+            hasher.shutdown()
+
+    def test_hashing_busy(self):
+        hasher = PasswordHasher('pbkdf2:sha256:1000', workers=1)
+        hasher._slots.acquire()  # the only slot is taken by a request in flight
+        self.app.extensions['todoism_password_hasher'] = hasher
+        response = self.client.post(url_for('auth.login'), json=dict(username='grey', password='123'))
+        data = response.get_json()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(data['message'], 'Too many logins at the moment, please try again later.')
@@ -5,10 +5,19 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
+import json
+import os
+import tempfile
 import unittest
-from flask import current_app
+from datetime import datetime, timedelta
+
+from flask import current_app, render_template_string
 from todoism import create_app
+from todoism.context import LazyContext
+from todoism.fakes import forge
+from todoism.loadtest import parse_mix, percentile, summarize
 from todoism.extensions import db
+from todoism.models import User, Item, Tombstone
 
 
 class BasicTestCase(unittest.TestCase):
@@ -28,3 +37,134 @@ class BasicTestCase(unittest.TestCase):
 
     def test_app_is_testing(self):
         self.assertTrue(current_app.config['TESTING'])
+
+    def test_recount_command(self):
+        user = User(username='grey')
+        user.items = [Item(body='Item 1'), Item(body='Item 2'), Item(body='Item 3', done=True)]
+        db.session.add(user)
+        db.session.commit()
+
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['recount', '--check'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('grey: 0/0/0, expected 3/2/1', result.output)
+
+        result = runner.invoke(args=['recount'])
+        self.assertIn('Rebuilt counters for 1 user(s).', result.output)
+        user = User.query.get(1)
+        self.assertEqual(user.all_item_count, 3)
+        self.assertEqual(user.active_item_count, 2)
+        self.assertEqual(user.completed_item_count, 1)
+
+        result = runner.invoke(args=['recount', '--check'])
+        self.assertEqual(result.exit_code, 0)
+        self.assertIn('0 user(s) with stale counters.', result.output)
+
+    def test_reap_command(self):
+        past = datetime.utcnow() - timedelta(days=1)
+        for i in range(3):
+            user = User(username='demo%d' % i, expires_at=past)
+            user.items = [Item(body='Item 1'), Item(body='Item 2', done=True)]
+            db.session.add(user)
+        user = User(username='grey')
+        user.items = [Item(body='Item 1')]
+        db.session.add(user)
+        db.session.add(User(username='fresh', expires_at=datetime.utcnow() + timedelta(days=1)))
+        db.session.commit()
+        db.session.add(Tombstone(item_id=42, version=1, author_id=1))
+        db.session.commit()
+
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['demo', 'reap', '--chunk-size', '2'])
+        self.assertIn('Reaped 3 account(s), 6 item(s), 1 tombstone(s) and 0 refresh token(s).', result.output)
+        self.assertEqual([user.username for user in User.query.order_by(User.id)], ['grey', 'fresh'])
+        self.assertEqual(Item.query.count(), 1)
+
+        result = runner.invoke(args=['demo', 'reap'])
+        self.assertIn('Reaped 0 account(s)', result.output)
+
+    def test_lazy_template_context(self):
+        calls = []
+        context = LazyContext()
+
+        @context.value('answer')
+        def answer():
+            calls.append(1)
+            return 42
+
+        self.app.context_processor(context.processor)
+        with self.app.test_request_context():
+            self.assertEqual(render_template_string('nothing'), 'nothing')
+            self.assertEqual(calls, [])
+            self.assertEqual(render_template_string('{{ answer }}'), '42')
+            self.assertEqual(render_template_string('{% if answer > 40 %}{{ answer + 1 }}{% endif %}'), '43')
+            self.assertEqual(calls, [1])
+        with self.app.test_request_context():
+            render_template_string('{{ answer }}')
+            self.assertEqual(calls, [1, 1])
+
+    def test_forge(self):
+        user_ids = forge(3, 4, done_ratio=0.5, seed=1, batch_size=5)
+        self.assertEqual(len(user_ids), 3)
+        self.assertEqual(Item.query.count(), 12)
+        self.assertTrue(User.query.get(user_ids[0]).validate_password('123'))
+        bodies = [item.body for item in Item.query.order_by(Item.id)]
+
+        result = self.app.test_cli_runner().invoke(args=['recount', '--check'])
+        self.assertEqual(result.exit_code, 0)
+
+        db.drop_all()
+        db.create_all()
+        forge(3, 4, done_ratio=0.5, seed=1)
+        self.assertEqual([item.body for item in Item.query.order_by(Item.id)], bodies)
+
+    def test_forge_command(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['forge', '--users', '3', '--items-per-user', '5', '--done-ratio', '1',
+                                     '--defer-indexes'])
+        self.assertIn('Forged 3 user(s) and 15 item(s)', result.output)
+        self.assertEqual(Item.query.filter_by(done=True).count(), 15)
+        indexes = {index['name'] for index in db.inspect(db.engine).get_indexes('item')}
+        self.assertIn('ix_item_author_id_done', indexes)
+
+    def test_loadtest_command(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['loadtest', '--workers', '0'])
+        self.assertIn('No forged users', result.output)
+
+        forge(2, 5)
+        fd, trace = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            result = runner.invoke(args=['loadtest', '--workers', '0', '--requests', '30', '--trace', trace])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('30 requests in', result.output)
+            with open(trace) as f:
+                records = [json.loads(line) for line in f]
+        finally:
+            os.remove(trace)
+        self.assertEqual(len(records), 30)
+        self.assertTrue(all(record['status'] < 400 for record in records))
+        # a login is measured with the password check, not redirected
+        self.assertTrue(all(record['status'] == 200 for record in records if record['workload'] == 'login'))
+
+        result = runner.invoke(args=['loadtest', '--mix', 'app=1,nap=2'])
+        self.assertEqual(result.exit_code, 2)
+
+    def test_loadtest_summary(self):
+        self.assertEqual(parse_mix('app=3,api'), {'app': 3, 'api': 1})
+        samples = [('app', 200, 0, 4.0), ('app', 500, 0.5, 30.0), ('api', 200, 0.2, 800.0)]
+        report = summarize(samples)
+        self.assertEqual(report['requests'], 3)
+        self.assertEqual(report['elapsed'], 1)
+        self.assertEqual(report['workloads']['app']['error_rate'], 0.5)
+        self.assertEqual(report['workloads']['app']['p50'], 4.0)
+        self.assertEqual(report['workloads']['api']['histogram']['1000'], 1)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([4.0, 30.0], 50), 4.0)
+        self.assertEqual(percentile([4.0], 99), 4.0)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import unittest
+
+from flask import url_for
+
+from todoism import create_app, db
+from todoism.cache import LRUCache, FragmentCache, get_identity_cache, get_token_cache, load_identity
+from todoism.models import User
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        app = create_app('testing')
+        self.app_context = app.test_request_context()
+        self.app_context.push()
+        db.create_all()
+        self.client = app.test_client()
+
+        user = User(username='grey')
+        user.set_password('123')
+        db.session.add(user)
+        db.session.commit()
+
+    def tearDown(self):
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_lru_cache(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        cache.set('d', 4, ttl=-1)
+        self.assertIsNone(cache.get('d'))
+
+    def test_fragment_cache(self):
+        cache = FragmentCache(maxsize=10, maxchars=10)
+        cache.set(1, 1, 'aaaa')
+        cache.set(2, 1, 'bbbb')
+        self.assertEqual(cache.get(1, 1), 'aaaa')
+        self.assertIsNone(cache.get(1, 2))
+        cache.set(3, 1, 'cccc')
+        self.assertIsNone(cache.get(2, 1))
+        self.assertEqual(cache.stats(), dict(entries=2, chars=8, hits=1, misses=2))
+        cache.set(4, 1, 'x' * 11)
+        self.assertIsNone(cache.get(4, 1))
+        cache.delete(1)
+        self.assertEqual(cache.chars, 4)
+
+    def test_load_identity(self):
+        self.assertEqual(load_identity(1).username, 'grey')
+        self.assertEqual(get_identity_cache().get(1)['username'], 'grey')
+        db.session.remove()
+
+        user = load_identity(1)
+        self.assertEqual(user.username, 'grey')
+        self.assertEqual(user.all_item_count, 0)
+        self.assertIsNone(load_identity(42))
+
+    def test_forget_changed_user(self):
+        load_identity(1)
+        self.client.post(url_for('auth.login'), json=dict(username='grey', password='123'))
+        self.client.get(url_for('home.set_locale', locale='zh_Hans_CN'))
+        self.assertIsNone(get_identity_cache().get(1))
+        self.assertEqual(load_identity(1).locale, 'zh_Hans_CN')
+
+        db.session.delete(User.query.get(1))
+        db.session.commit()
+        self.assertIsNone(get_identity_cache().get(1))
+
+    def test_token_cache(self):
+        response = self.client.post(url_for('api_v1.token'), data=dict(grant_type='password', username='grey',
+                                                                       password='123'))
+        token = response.get_json()['access_token']
+        headers = {'Authorization': 'Bearer ' + token}
+        self.client.get(url_for('api_v1.user'), headers=headers)
+        self.assertEqual(get_token_cache().get(token), 1)
+
+        response = self.client.get(url_for('api_v1.user'), headers={'Authorization': 'Bearer ' + token + 'x'})
+        self.assertEqual(response.status_code, 401)
@@ -10,6 +10,7 @@ import unittest
 from flask import url_for
 
 from todoism import create_app, db
+from todoism.pages import get_page_cache, CSRF_PLACEHOLDER
 
 
 class HomeTestCase(unittest.TestCase):
@@ -59,3 +60,38 @@ class HomeTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(u'我们是Todo爱好者，我们使用Todoism。', data)
         self.assertIn(u'登录', data)
+
+    def test_page_cache(self):
+        cache = get_page_cache()
+        response = self.client.get(url_for('home.intro'))
+        etag = response.headers['ETag']
+        self.assertTrue(response.cache_control.no_cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        response = self.client.get(url_for('home.intro'), headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        response = self.client.get(url_for('home.intro'), headers={'Accept-Language': 'zh-Hans-CN'})
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(len(cache), 2)
+
+        cache.translations_path = '/nonexistent'
+        cache.check_interval = 0
+        self.client.get(url_for('home.intro'))
+        self.assertEqual(len(cache), 1)
+
+    def test_index_csrf_token(self):
+        first = self.client.get(url_for('home.index')).get_data(as_text=True)
+        second = self.client.get(url_for('home.index')).get_data(as_text=True)
+        self.assertNotIn(CSRF_PLACEHOLDER, first)
+        self.assertIn('var csrf_token = "', second)
+        self.assertEqual(get_page_cache().hits, 1)
+
+    def test_error_page_cache(self):
+        response = self.client.get('/missing', headers={'Accept': 'text/html'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/missing', headers={'Accept': 'text/html'})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('Page Not Found', response.get_data(as_text=True))
+        self.assertEqual(get_page_cache().hits, 1)
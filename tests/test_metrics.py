@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import url_for
+
+from todoism import create_app, db
+from todoism.metrics import Registry, render, sample
+from todoism.models import User
+
+
+def count_in_child(registry):
+    registry.inc(sample('todoism_requests_total', endpoint='todo.app'), 2)
+    registry.inc(sample('todoism_requests_in_flight', blueprint='todo'))
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.context = self.app.test_request_context()
+        self.context.push()
+        self.client = self.app.test_client()
+        db.create_all()
+        user = User(username='grey')
+        user.set_password('123')
+        db.session.add(user)
+        db.session.commit()
+        self.app.config['TODOISM_METRICS_TOKEN'] = 'secret'
+
+    def tearDown(self):
+        db.drop_all()
+        self.context.pop()
+
+    def scrape(self, **kwargs):
+        kwargs.setdefault('headers', {'Authorization': 'Bearer secret'})
+        response = self.client.get(url_for('metrics.metrics'), **kwargs)
+        return response.status_code, response.get_data(as_text=True)
+
+    def test_metrics(self):
+        self.client.post(url_for('auth.login'), json=dict(username='grey', password='123'))
+        self.client.get(url_for('todo.app'))
+        status, data = self.scrape()
+        self.assertEqual(status, 200)
+        self.assertIn('# TYPE todoism_request_duration_seconds histogram', data)
+        self.assertIn('todoism_requests_total{blueprint="todo",endpoint="todo.app",method="GET",status="200"} 1.0',
+                      data)
+        self.assertIn('todoism_request_duration_seconds_bucket{blueprint="todo",endpoint="todo.app",le="+Inf"} 1.0',
+                      data)
+        self.assertIn('todoism_requests_in_flight{blueprint="todo"} 0.0', data)
+        self.assertIn('todoism_cache_hits_total{cache="identity"}', data)
+
+    def test_auth_failures(self):
+        self.client.post(url_for('auth.login'), json=dict(username='grey', password='456'))
+        self.client.post(url_for('api_v1.token'), data=dict(grant_type='password', username='grey', password='456'))
+        self.client.get(url_for('api_v1.user'), headers={'Authorization': 'Bearer bad'})
+        status, data = self.scrape()
+        self.assertIn('todoism_auth_failures_total{reason="login"} 1.0', data)
+        self.assertIn('todoism_auth_failures_total{reason="password_grant"} 1.0', data)
+        self.assertIn('todoism_auth_failures_total{reason="invalid_token"} 1.0', data)
+
+    def test_scrape_access(self):
+        status, data = self.scrape(environ_base={'REMOTE_ADDR': '203.0.113.7'})
+        self.assertEqual(status, 200)
+        status, data = self.scrape(headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(status, 404)
+        status, data = self.scrape(headers={})
+        self.assertEqual(status, 404)
+
+        self.app.config['TODOISM_METRICS_TOKEN'] = None
+        status, data = self.scrape(headers={})
+        self.assertEqual(status, 404)
+        self.app.config['TODOISM_METRICS_ALLOW_LOCALHOST'] = True
+        status, data = self.scrape(headers={})
+        self.assertEqual(status, 200)
+        status, data = self.scrape(headers={'X-Forwarded-For': '203.0.113.5'})
+        self.assertEqual(status, 404)
+        status, data = self.scrape(headers={}, environ_base={'REMOTE_ADDR': '203.0.113.7'})
+        self.assertEqual(status, 404)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'needs fork')
+    def test_shared_registry(self):
+        directory = tempfile.mkdtemp()
+        try:
+            registry = Registry(directory)
+            registry.inc(sample('todoism_requests_total', endpoint='todo.app'))
+            child = multiprocessing.get_context('fork').Process(target=count_in_child, args=(registry,))
+            child.start()
+            child.join()
+            values = registry.collect()
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(values[sample('todoism_requests_total', endpoint='todo.app')], 3)
+        # the gauge of the exited worker is left out
+        self.assertNotIn(sample('todoism_requests_in_flight', blueprint='todo'), values)
+        self.assertIn('# TYPE todoism_requests_total counter', render(values))
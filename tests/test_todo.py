@@ -5,11 +5,14 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
+import json
 import unittest
 
-from flask import url_for
+from flask import current_app, url_for
 
 from todoism import create_app, db
+from todoism.cache import get_fragment_cache
+from todoism.instrument import QueryLimitExceeded
 from todoism.models import User, Item
 
 
@@ -85,6 +88,10 @@ class ToDoTestCase(unittest.TestCase):
         data = response.get_json()
         self.assertEqual(response.status_code, 403)
         self.assertEqual(data['message'], 'Permission denied.')
+        self.assertIsNotNone(Item.query.get(4))
+
+        response = self.client.delete(url_for('todo.delete_item', item_id=1))
+        self.assertEqual(response.status_code, 404)
 
     def test_toggle_item(self):
         response = self.client.patch(url_for('todo.toggle_item', item_id=1))
@@ -102,6 +109,9 @@ class ToDoTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 403)
         self.assertEqual(data['message'], 'Permission denied.')
 
+        response = self.client.patch(url_for('todo.toggle_item', item_id=42))
+        self.assertEqual(response.status_code, 404)
+
     def test_clear_item(self):
         self.client.patch(url_for('todo.toggle_item', item_id=1))
         self.client.patch(url_for('todo.toggle_item', item_id=2))
@@ -112,3 +122,121 @@ class ToDoTestCase(unittest.TestCase):
         self.assertEqual(Item.query.get(1), None)
         self.assertEqual(Item.query.get(2), None)
         self.assertNotEqual(Item.query.get(3), None)
+
+    def test_item_counters(self):
+        user = User.query.get(1)
+        user.all_item_count, user.active_item_count = 3, 3
+        db.session.commit()
+
+        self.client.post(url_for('todo.new_item'), json=dict(body='Item 4'))
+        self.client.patch(url_for('todo.toggle_item', item_id=1))
+        self.client.patch(url_for('todo.toggle_item', item_id=2))
+        self.client.delete(url_for('todo.delete_item', item_id=3))
+        self.assertEqual((user.all_item_count, user.active_item_count, user.completed_item_count), (3, 1, 2))
+
+        self.client.delete(url_for('todo.clear_items'))
+        self.assertEqual((user.all_item_count, user.active_item_count, user.completed_item_count), (1, 1, 0))
+
+        response = self.client.get(url_for('todo.app'))
+        data = response.get_data(as_text=True)
+        self.assertIn('<span class="grey-text small-text" id="all-count">1</span>', data)
+
+    def test_complete_and_activate_items(self):
+        response = self.client.patch(url_for('todo.complete_items'))
+        data = response.get_json()
+        self.assertEqual(data['message'], 'All items marked as done.')
+        self.assertEqual(Item.query.filter_by(author_id=1, done=True).count(), 3)
+        self.assertFalse(Item.query.get(4).done)
+
+        response = self.client.patch(url_for('todo.activate_items'))
+        data = response.get_json()
+        self.assertEqual(data['message'], 'All items marked as active.')
+        self.assertEqual(Item.query.filter_by(author_id=1, done=False).count(), 3)
+
+    def test_delete_user_deletes_items(self):
+        user = User.query.get(2)
+        db.session.delete(user)
+        db.session.commit()
+        self.assertIsNone(Item.query.get(4))
+        self.assertEqual(Item.query.count(), 3)
+
+    def test_fragment_cache(self):
+        cache = get_fragment_cache()
+        self.client.get(url_for('todo.app'))
+        self.assertEqual((cache.hits, cache.misses, len(cache)), (0, 3, 3))
+        response = self.client.get(url_for('todo.app'))
+        self.assertEqual((cache.hits, cache.misses), (3, 3))
+        self.assertIn('Item 2', response.get_data(as_text=True))
+
+        self.client.put(url_for('todo.edit_item', item_id=2), json=dict(body='Item 2 edited'))
+        self.client.patch(url_for('todo.toggle_item', item_id=3))
+        response = self.client.get(url_for('todo.app'))
+        data = response.get_data(as_text=True)
+        self.assertIn('Item 2 edited', data)
+        self.assertIn('check_box<', data)
+        self.assertEqual((cache.hits, cache.misses), (4, 5))
+
+        # bulk changes are caught by the version check
+        self.client.patch(url_for('todo.complete_items'))
+        data = self.client.get(url_for('todo.app')).get_data(as_text=True)
+        self.assertEqual(data.count('check_box<'), 3)
+
+    def test_item_windows(self):
+        self.client.application.config['TODOISM_APP_WINDOW_SIZE'] = 2
+        response = self.client.get(url_for('todo.app'))
+        data = response.get_data(as_text=True)
+        self.assertIn('Item 2', data)
+        self.assertNotIn('Item 3', data)
+        self.assertIn('data-next="%s"' % url_for('todo.items', after=2), data)
+
+        response = self.client.get(url_for('todo.items', after=2))
+        data = response.get_json()
+        self.assertIn('Item 3', data['html'])
+        self.assertNotIn('Item 2', data['html'])
+        self.assertIsNone(data['next'])
+
+    def test_mutations_return_counts(self):
+        user = User.query.get(1)
+        user.all_item_count = user.active_item_count = 3
+        db.session.commit()
+        response = self.client.post(url_for('todo.new_item'), json=dict(body='Item 4'))
+        self.assertEqual(response.get_json()['counts'], dict(all=4, active=4, completed=0))
+        response = self.client.patch(url_for('todo.toggle_item', item_id=1))
+        self.assertEqual(response.get_json()['counts'], dict(all=4, active=3, completed=1))
+        response = self.client.delete(url_for('todo.clear_items'))
+        self.assertEqual(response.get_json()['counts'], dict(all=3, active=3, completed=0))
+
+    def test_client_rendering(self):
+        self.client.application.config['TODOISM_CLIENT_RENDERING'] = True
+        self.client.application.config['TODOISM_APP_WINDOW_SIZE'] = 2
+        response = self.client.get(url_for('todo.app'))
+        data = response.get_data(as_text=True)
+        self.assertIn('<template id="item-template">', data)
+        self.assertIn('data-href="%s"' % url_for('todo.edit_item', item_id=0), data)
+
+        response = self.client.post(url_for('todo.new_item'), json=dict(body='Item 4'))
+        data = response.get_json()
+        self.assertNotIn('html', data)
+        self.assertEqual(data['item'], dict(id=5, body='Item 4', done=False))
+
+        response = self.client.get(url_for('todo.items', after=2))
+        data = response.get_json()
+        self.assertEqual(data['items'], [dict(id=3, body='Item 3', done=False), dict(id=5, body='Item 4', done=False)])
+        self.assertIsNone(data['next'])
+
+    def test_server_timing(self):
+        with self.assertLogs('todoism.instrument', 'INFO') as logs:
+            response = self.client.get(url_for('todo.app'))
+        metrics = dict(metric.strip().split(';', 1) for metric in response.headers['Server-Timing'].split(','))
+        self.assertEqual(sorted(metrics), ['auth', 'db', 'total', 'tpl'])
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['endpoint'], 'todo.app')
+        self.assertIn('desc="%d queries"' % record['queries'], metrics['db'])
+        self.assertGreater(record['queries'], 0)
+        self.assertGreater(record['tpl_ms'], 0)
+
+    def test_query_limit(self):
+        limits = current_app.config['TODOISM_QUERY_LIMITS']
+        current_app.config['TODOISM_QUERY_LIMITS'] = dict(limits, **{'todo.app': 1})
+        with self.assertRaises(QueryLimitExceeded):
+            self.client.get(url_for('todo.app'))
@@ -5,7 +5,12 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
+import json
+import multiprocessing
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 
 import click
 from flask import Flask, render_template, jsonify, request
@@ -15,9 +20,19 @@ from flask_login import current_user
 from todoism.apis.v1 import api_v1
 from todoism.blueprints.auth import auth_bp
 from todoism.blueprints.home import home_bp
+from todoism.blueprints.metrics import metrics_bp
 from todoism.blueprints.todo import todo_bp
+from todoism.cache import init_cache
+from todoism.context import template_context
+from todoism.demo import fill_demo_pool, reap_demo_accounts
 from todoism.extensions import db, login_manager, csrf, babel
-from todoism.models import User, Item
+from todoism.fakes import forge
+from todoism.instrument import init_instrumentation
+from todoism.loadtest import DEFAULT_MIX, WSGIClient, parse_mix, play, run_worker, summarize
+from todoism.metrics import init_metrics
+from todoism.models import User, Item, Tombstone, RefreshToken
+from todoism.pages import init_page_cache, render_cached
+from todoism.passwords import init_hasher, HashingBusy
 from todoism.settings import config
 
 
@@ -37,6 +52,11 @@ def create_app(config_name=None):
 
 
 def register_extensions(app):
+    init_cache(app)
+    init_hasher(app)
+    init_page_cache(app)
+    init_instrumentation(app)
+    init_metrics(app)
     db.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
@@ -48,28 +68,32 @@ def register_blueprints(app):
     app.register_blueprint(auth_bp)
     app.register_blueprint(todo_bp)
     app.register_blueprint(home_bp)
+    app.register_blueprint(metrics_bp)
     app.register_blueprint(api_v1, url_prefix='/api/v1')
     # app.register_blueprint(api_v1, url_prefix='/v1', subdomain='api')  # enable subdomain support
 
 
 def register_template_context(app):
-    @app.context_processor
-    def make_template_context():
+    @template_context.value('active_items')
+    def active_items():
         if current_user.is_authenticated:
-            active_items = Item.query.with_parent(current_user).filter_by(done=False).count()
-        else:
-            active_items = None
-        return dict(active_items=active_items)
+            return current_user.active_item_count
+        return None
+
+    app.context_processor(template_context.processor)
 
 
 def register_errors(app):
+    def render_error(code, info):
+        return render_cached(('errors', code), lambda: render_template('errors.html', code=code, info=info)), code
+
     @app.errorhandler(400)
     def bad_request(e):
-        return render_template('errors.html', code=400, info=_('Bad Request')), 400
+        return render_error(400, _('Bad Request'))
 
     @app.errorhandler(403)
     def forbidden(e):
-        return render_template('errors.html', code=403, info=_('Forbidden')), 403
+        return render_error(403, _('Forbidden'))
 
     @app.errorhandler(404)
     def page_not_found(e):
@@ -79,7 +103,7 @@ def register_errors(app):
             response = jsonify(code=404, message='The requested URL was not found on the server.')
             response.status_code = 404
             return response
-        return render_template('errors.html', code=404, info=_('Page Not Found')), 404
+        return render_error(404, _('Page Not Found'))
 
     @app.errorhandler(405)
     def method_not_allowed(e):
@@ -87,6 +111,13 @@ def register_errors(app):
         response.status_code = 405
         return response
 
+    @app.errorhandler(HashingBusy)
+    def hashing_busy(e):
+        response = jsonify(code=503, message=_('Too many logins at the moment, please try again later.'))
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
+
     @app.errorhandler(500)
     def internal_server_error(e):
         if request.accept_mimetypes.accept_json and \
@@ -95,7 +126,7 @@ def register_errors(app):
             response = jsonify(code=500, message='An internal server error occurred.')
             response.status_code = 500
             return response
-        return render_template('errors.html', code=500, info=_('Server Error')), 500
+        return render_error(500, _('Server Error'))
 
 
 def register_commands(app):
@@ -110,6 +141,149 @@ def register_commands(app):
         db.create_all()
         click.echo('Initialized database.')
 
+    @app.cli.command('forge')
+    @click.option('--users', default=10, help='Quantity of users, default is 10.')
+    @click.option('--items-per-user', default=100, help='Quantity of items per user, default is 100.')
+    @click.option('--done-ratio', default=0.2, help='Share of completed items, default is 0.2.')
+    @click.option('--seed', default=42, help='Random seed, the same seed forges the same data.')
+    @click.option('--batch-size', default=10000, help='Rows per INSERT batch, default is 10000.')
+    @click.option('--defer-indexes', is_flag=True, help='Build the item indexes after loading (SQLite only).')
+    def forge_command(users, items_per_user, done_ratio, seed, batch_size, defer_indexes):
+        """Generate fake users and items with bulk inserts."""
+        if defer_indexes and db.engine.name != 'sqlite':
+            raise click.BadParameter('only supported on SQLite.', param_hint='--defer-indexes')
+        start = time.time()
+        forge(users, items_per_user, done_ratio, seed, batch_size, defer_indexes=defer_indexes)
+        click.echo('Forged %d user(s) and %d item(s) in %.1fs.' % (users, users * items_per_user,
+                                                                   time.time() - start))
+
+    @app.cli.command()
+    @click.option('--workers', default=4, help='Worker processes, 0 runs one user in this process.')
+    @click.option('--requests', default=200, help='Requests per worker, default is 200.')
+    @click.option('--duration', type=float, help='Run for this many seconds instead.')
+    @click.option('--mix', default=DEFAULT_MIX, help='Workload weights, default is %s.' % DEFAULT_MIX)
+    @click.option('--url', help='Load a running server, e.g. http://127.0.0.1:5000, instead of the app.')
+    @click.option('--password', default='123', help='Password of the forged users.')
+    @click.option('--seed', default=42, help='Random seed of the first worker.')
+    @click.option('--trace', type=click.Path(), help='Write every request as a JSON line to this file.')
+    def loadtest(workers, requests, duration, mix, url, password, seed, trace):
+        """Replay a mix of workloads with forged users."""
+        try:
+            weights = parse_mix(mix)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--mix')
+        usernames = [username for username, in db.session.query(User.username).filter(
+            User.username.like('forge%')).order_by(User.id).limit(max(workers, 1))]
+        if not usernames:
+            raise click.ClickException('No forged users, run flask forge first.')
+
+        if workers:
+            # spawned workers start clean, a fork would inherit the open database connections and pools
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                futures = [executor.submit(run_worker, url, os.getenv('FLASK_CONFIG', 'development'),
+                                           usernames[number % len(usernames)], password, weights,
+                                           requests, duration, seed + number) for number in range(workers)]
+                results = [future.result() for future in futures]
+        else:
+            client = WSGIClient(app)
+            results = [(os.getpid(), play(client, usernames[0], password, weights, requests, duration, seed))]
+        report = summarize([sample for pid, samples in results for sample in samples])
+
+        if trace:
+            with open(trace, 'w') as f:
+                for pid, samples in results:
+                    for name, status, started, latency in samples:
+                        f.write(json.dumps(dict(pid=pid, workload=name, status=status, start=round(started, 6),
+                                                latency_ms=round(latency, 3))) + '\n')
+        click.echo('%d requests in %.1fs, %.1f requests/s.' % (report['requests'], report['elapsed'],
+                                                                report['throughput']))
+        for name, stats in sorted(report['workloads'].items()):
+            click.echo('%-8s %6d requests  %6.2f%% errors  p50 %8.2f  p95 %8.2f  p99 %8.2f ms' % (
+                name, stats['requests'], stats['error_rate'] * 100, stats['p50'], stats['p95'], stats['p99']))
+            click.echo('         ' + '  '.join('<=%s:%d' % (bound, count)
+                                               for bound, count in stats['histogram'].items() if count))
+
+    @app.cli.command()
+    @click.option('--check', is_flag=True, help='Only verify the counters, do not fix them.')
+    def recount(check):
+        """Rebuild the cached item counters of every user."""
+        completed = db.func.sum(db.case([(Item.done == True, 1)], else_=0))  # noqa: E712
+        rows = db.session.query(Item.author_id, db.func.count(Item.id), completed).group_by(Item.author_id)
+        actual = {author_id: (total, int(done or 0)) for author_id, total, done in rows}
+
+        stale = []
+        users = db.session.query(User.id, User.username, User.all_item_count,
+                                 User.active_item_count, User.completed_item_count)
+        for user_id, username, all_count, active_count, completed_count in users:
+            total, done = actual.get(user_id, (0, 0))
+            if (all_count, active_count, completed_count) != (total, total - done, done):
+                click.echo('%s: %s/%s/%s, expected %s/%s/%s' % (username, all_count, active_count, completed_count,
+                                                               total, total - done, done))
+                stale.append(dict(user_id=user_id, all_count=total, active_count=total - done, completed_count=done))
+
+        if check:
+            click.echo('%d user(s) with stale counters.' % len(stale))
+            if stale:
+                raise SystemExit(1)
+            return
+
+        if stale:
+            db.session.execute(User.__table__.update().where(User.id == db.bindparam('user_id')).values(
+                all_item_count=db.bindparam('all_count'),
+                active_item_count=db.bindparam('active_count'),
+                completed_item_count=db.bindparam('completed_count')), stale)
+            db.session.commit()
+        click.echo('Rebuilt counters for %d user(s).' % len(stale))
+
+    @app.cli.command()
+    @click.option('--days', type=int, help='Retention period, defaults to TODOISM_TOMBSTONE_RETENTION_DAYS.')
+    def compact(days):
+        """Delete the tombstones of deleted items after the retention period."""
+        if days is None:
+            days = app.config['TODOISM_TOMBSTONE_RETENTION_DAYS']
+        expired = Tombstone.deleted_at < datetime.utcnow() - timedelta(days=days)
+        # clients that synced before the compacted versions will be asked to fetch everything again
+        floor = db.select([db.func.max(Tombstone.version)]).where(
+            db.and_(Tombstone.author_id == User.id, expired)).as_scalar()
+        db.session.query(User).filter(User.id.in_(db.select([Tombstone.author_id]).where(expired))).update(
+            {User.compacted_version: floor}, synchronize_session=False)
+        count = Tombstone.query.filter(expired).delete(synchronize_session=False)
+        db.session.commit()
+        click.echo('Compacted %d tombstone(s).' % count)
+
+    @app.cli.command('purge-tokens')
+    def purge_tokens():
+        """Delete expired and revoked refresh tokens."""
+        count = RefreshToken.query.filter(db.or_(RefreshToken.expires_at < datetime.utcnow(),
+                                                 RefreshToken.revoked == True)).delete(  # noqa: E712
+            synchronize_session=False)
+        db.session.commit()
+        click.echo('Purged %d refresh token(s).' % count)
+
+    @app.cli.group()
+    def demo():
+        """Demo account commands."""
+        pass
+
+    @demo.command()
+    @click.option('--size', type=int, help='Accounts per locale, defaults to TODOISM_DEMO_POOL_SIZE.')
+    def fill(size):
+        """Top up the pool of demo accounts handed out by /register."""
+        if size is None:
+            size = app.config['TODOISM_DEMO_POOL_SIZE']
+        for locale in app.config['TODOISM_LOCALES']:
+            click.echo('%s: created %d account(s).' % (locale, fill_demo_pool(size, locale)))
+
+    @demo.command()
+    @click.option('--chunk-size', type=int, help='Accounts per transaction, defaults to TODOISM_REAP_CHUNK_SIZE.')
+    def reap(chunk_size):
+        """Delete expired demo accounts with their items."""
+        if chunk_size is None:
+            chunk_size = app.config['TODOISM_REAP_CHUNK_SIZE']
+        reaped = reap_demo_accounts(chunk_size)
+        click.echo('Reaped %d account(s), %d item(s), %d tombstone(s) and %d refresh token(s).' % (
+            reaped['user'], reaped['item'], reaped['tombstone'], reaped['refresh_token']))
+
     @app.cli.group()
     def translate():
         """Translation and localization commands."""
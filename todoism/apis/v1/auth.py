@@ -5,29 +5,84 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
+import hashlib
+import os
+import time
+from datetime import datetime, timedelta
 from functools import wraps
 
 from flask import g, current_app, request
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, BadSignature, SignatureExpired
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, BadSignature, SignatureExpired, \
+    URLSafeSerializer
 
 from todoism.apis.v1.errors import api_abort, invalid_token, token_missing
-from todoism.models import User
+from todoism.cache import load_identity, get_token_cache
+from todoism.extensions import db
+from todoism.instrument import timed
+from todoism.metrics import count_auth_failure
+from todoism.models import RefreshToken
+
+_serializers = {}
+
+
+def get_serializer(expires_in=None):
+    """Return a shared serializer, they are stateless so one instance serves every request."""
+    key = (current_app.config['SECRET_KEY'], expires_in)
+    if key not in _serializers:
+        _serializers[key] = Serializer(current_app.config['SECRET_KEY'], expires_in=expires_in)
+    return _serializers[key]
 
 
 def generate_token(user):
     expiration = 3600
-    s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
-    token = s.dumps({'id': user.id}).decode('ascii')
+    token = get_serializer(expiration).dumps({'id': user.id}).decode('ascii')
     return token, expiration
 
 
-def validate_token(token):
-    s = Serializer(current_app.config['SECRET_KEY'])
+def get_refresh_serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='refresh-token')
+
+
+def generate_refresh_token(user):
+    """Store a new refresh token for the user and return it, the caller commits."""
+    secret = os.urandom(24).hex()
+    expires_at = datetime.utcnow() + timedelta(days=current_app.config['TODOISM_REFRESH_TOKEN_DAYS'])
+    db.session.add(RefreshToken(token_hash=hashlib.sha256(secret.encode('ascii')).hexdigest(),
+                                expires_at=expires_at, user_id=user.id))
+    return get_refresh_serializer().dumps(secret)
+
+
+def load_refresh_token(token):
+    """Return the stored refresh token, or None if it is forged, unknown, revoked or expired.
+
+    Forged tokens fail the signature check without touching the database,
+    valid ones cost a single lookup on the indexed digest.
+    """
     try:
-        data = s.loads(token)
-    except (BadSignature, SignatureExpired):
-        return False
-    user = User.query.get(data['id'])
+        secret = get_refresh_serializer().loads(token)
+    except BadSignature:
+        return None
+    if not isinstance(secret, str):
+        return None
+    refresh_token = RefreshToken.query.filter_by(token_hash=hashlib.sha256(secret.encode('utf-8')).hexdigest()).first()
+    if refresh_token is None or refresh_token.revoked or refresh_token.expires_at < datetime.utcnow():
+        return None
+    return refresh_token
+
+
+@timed('auth')
+def validate_token(token):
+    cache = get_token_cache()
+    user_id = cache.get(token)
+    if user_id is None:
+        try:
+            data, header = get_serializer().loads(token, return_header=True)
+        except (BadSignature, SignatureExpired):
+            return False
+        user_id = data['id']
+        # a verified token is trusted until it expires, so it is never cached past that point
+        cache.set(token, user_id, ttl=header['exp'] - time.time())
+    user = load_identity(user_id)
     if user is None:
         return False
     g.current_user = user
@@ -60,10 +115,13 @@ def auth_required(f):
         # to avoid unwanted interactions with CORS.
         if request.method != 'OPTIONS':
             if token_type is None or token_type.lower() != 'bearer':
+                count_auth_failure('token_type')
                 return api_abort(400, 'The token type must be bearer.')
             if token is None:
+                count_auth_failure('token_missing')
                 return token_missing()
             if not validate_token(token):
+                count_auth_failure('invalid_token')
                 return invalid_token()
         return f(*args, **kwargs)
 
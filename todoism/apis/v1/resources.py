@@ -5,15 +5,265 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from flask import jsonify, request, current_app, url_for, g
+import csv
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import zlib
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from flask import jsonify, request, current_app, url_for, g, abort, stream_with_context
 from flask.views import MethodView
+from itsdangerous import URLSafeSerializer, BadSignature
 
 from todoism.apis.v1 import api_v1
-from todoism.apis.v1.auth import auth_required, generate_token
+from todoism.apis.v1.auth import auth_required, generate_token, generate_refresh_token, load_refresh_token
 from todoism.apis.v1.errors import api_abort, ValidationError
-from todoism.apis.v1.schemas import user_schema, item_schema, items_schema
+from todoism.apis.v1.schemas import user_schema, item_schema, items_schema, ItemSerializer, get_fields
+from todoism.cache import load_identity
 from todoism.extensions import db
-from todoism.models import User, Item
+from todoism.metrics import count_auth_failure
+from todoism.models import User, Item, Tombstone
+
+
+def get_cursor_serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='item-cursor')
+
+
+def encode_cursor(**position):
+    return get_cursor_serializer().dumps(position)
+
+
+def decode_cursor(cursor):
+    """Return the (after, before) item ids of an opaque cursor, an empty cursor starts from the beginning."""
+    if not cursor:
+        return None, None
+    try:
+        position = get_cursor_serializer().loads(cursor)
+    except BadSignature:
+        raise ValidationError('The cursor was invalid.')
+    return position.get('after'), position.get('before')
+
+
+def get_items(query, endpoint, counter):
+    """Serialize a page of items, using keyset pagination when the ``cursor`` argument was given."""
+    per_page = request.args.get('per_page', current_app.config['TODOISM_ITEM_PER_PAGE'], type=int)
+    per_page = min(max(per_page, 1), current_app.config['TODOISM_ITEM_MAX_PER_PAGE'])
+    # keep the page size and the sparse fieldset in the links to other pages
+    args = {key: request.args[key] for key in ('per_page', 'fields') if key in request.args}
+
+    if 'cursor' not in request.args:
+        page = request.args.get('page', 1, type=int)
+        pagination = query.paginate(page, per_page)
+        current = url_for(endpoint, page=page, _external=True, **args)
+        prev = None
+        if pagination.has_prev:
+            prev = url_for(endpoint, page=page - 1, _external=True, **args)
+        next = None
+        if pagination.has_next:
+            next = url_for(endpoint, page=page + 1, _external=True, **args)
+        return items_schema(pagination.items, current, prev, next, pagination)
+
+    cursor = request.args['cursor']
+    after, before = decode_cursor(cursor)
+    if before is not None:
+        items = query.filter(Item.id < before).order_by(Item.id.desc()).limit(per_page + 1).all()
+        has_prev, has_next = len(items) > per_page, True
+        items = items[:per_page][::-1]
+    else:
+        if after is not None:
+            query = query.filter(Item.id > after)
+        items = query.order_by(Item.id).limit(per_page + 1).all()
+        has_prev, has_next = after is not None, len(items) > per_page
+        items = items[:per_page]
+
+    if 'count' in request.args:
+        args['count'] = request.args['count']
+    current = url_for(endpoint, cursor=cursor, _external=True, **args)
+    prev = None
+    if has_prev:
+        start = items[0].id if items else after + 1
+        prev = url_for(endpoint, cursor=encode_cursor(before=start), _external=True, **args)
+    next = None
+    if has_next:
+        end = items[-1].id if items else before - 1
+        next = url_for(endpoint, cursor=encode_cursor(after=end), _external=True, **args)
+    count = None
+    if request.args.get('count', 'false').lower() in ('1', 'true'):
+        count = getattr(g.current_user, counter)
+    first = url_for(endpoint, cursor='', _external=True, **args)
+    return items_schema(items, current, prev, next, count=count, first=first)
+
+
+def render_json(data):
+    """Like jsonify, but encoded with orjson when it is installed and TODOISM_FAST_JSON is on."""
+    if orjson is not None and current_app.config['TODOISM_FAST_JSON']:
+        return current_app.response_class(orjson.dumps(data), mimetype='application/json')
+    return jsonify(data)
+
+
+def item_not_owned(item_id):
+    author_id = db.session.query(Item.author_id).filter_by(id=item_id).scalar()
+    if author_id is None:
+        abort(404)
+    if author_id == g.current_user.id:
+        # an own item only misses when the If-Match precondition failed
+        return api_abort(412, 'The item was changed since the given version.')
+    return api_abort(403)
+
+
+def item_etag(item_id, version):
+    return 'item-%d-%d' % (item_id, version)
+
+
+def get_base_version(item_id):
+    """Return the user version an If-Match request was based on, or None if the request is unconditional.
+
+    An item tagged with user version N can't have been changed after N, so
+    the scoped statements only match if ``item.version <= N``.
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    versions = []
+    for etag in request.if_match.as_set():
+        prefix, _, version = etag.rpartition('-')
+        if prefix == 'item-%d' % item_id and version.isdigit():
+            versions.append(int(version))
+    # a precondition naming none of this item's representations never matches
+    return max(versions) if versions else -1
+
+
+def is_fresh(etag):
+    """Tell if the representation cached by the client is still current."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    last_modified = g.current_user.items_updated_at
+    if request.if_modified_since is not None and last_modified is not None:
+        # compared at full precision, the header is truncated to the second and a change
+        # made later in that same second must not be answered with a 304
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def add_validators(response, etag):
+    response.set_etag(etag)
+    response.last_modified = g.current_user.items_updated_at
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def render_conditional(etag, build):
+    """Render ``build()`` as JSON tagged with ``etag``, or answer 304 without building it."""
+    if is_fresh(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = render_json(build())
+    return add_validators(response, etag)
+
+
+def collection_etag():
+    user = g.current_user
+    return 'items-%d-%d-%s' % (user.id, user.item_version, hashlib.md5(request.url.encode('utf-8')).hexdigest())
+
+
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+EXPORT_FIELDS = ('id', 'body', 'done')
+# rows fetched per round trip, and bytes buffered before a chunk is sent
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def export_lines(rows, format):
+    """Yield the encoded lines of an export, one row at a time."""
+    if format == 'ndjson':
+        for row in rows:
+            yield json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in itertools.chain([EXPORT_FIELDS], rows):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def export_chunks(lines, compress=False):
+    """Group lines into chunks of about EXPORT_CHUNK_SIZE bytes, optionally gzipped."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    chunk = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        chunk.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_SIZE:
+            data = b''.join(chunk)
+            yield compressor.compress(data) if compressor else data
+            chunk = []
+            size = 0
+    data = b''.join(chunk)
+    if compressor:
+        yield compressor.compress(data) + compressor.flush()
+    elif data:
+        yield data
+
+
+IMPORT_FORMATS = {'application/x-ndjson': 'ndjson', 'text/csv': 'csv'}
+# the summary of an import reports at most this many failed lines
+IMPORT_MAX_ERRORS = 100
+
+
+def parse_done(value):
+    """Read the optional done flag of an imported item, NDJSON gives a bool and CSV a string."""
+    if value is None or value == '':
+        return False
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.lower() in ('true', 'false', '1', '0'):
+        return value.lower() in ('true', '1')
+    raise ValueError('The done field must be true or false.')
+
+
+def import_records(lines, format):
+    """Parse an import one line at a time, yield ``(line, item, error)`` where only one of the last two is set."""
+    if format == 'ndjson':
+        records = ((number, line) for number, line in enumerate(lines, 1) if line.strip())
+    else:
+        reader = csv.DictReader(lines)
+        if reader.fieldnames is None or 'body' not in reader.fieldnames:
+            yield 1, None, 'The CSV header must have a body column.'
+            return
+        records = ((reader.line_num, record) for record in reader)
+
+    for number, record in records:
+        if format == 'ndjson':
+            try:
+                record = json.loads(record)
+            except ValueError:
+                yield number, None, 'The line was not valid JSON.'
+                continue
+            if not isinstance(record, dict):
+                yield number, None, 'The line must be a JSON object.'
+                continue
+        body = record.get('body')
+        if not isinstance(body, str) or body.strip() == '':
+            yield number, None, 'The item body was empty or invalid.'
+            continue
+        try:
+            done = parse_done(record.get('done'))
+        except ValueError as e:
+            yield number, None, str(e)
+            continue
+        yield number, {'body': body, 'done': done}, None
 
 
 def get_item_body():
@@ -33,9 +283,13 @@ class IndexAPI(MethodView):
             "current_user_url": "http://example.com/api/v1/user",
             "authentication_url": "http://example.com/api/v1/token",
             "item_url": "http://example.com/api/v1/items/{item_id }",
-            "current_user_items_url": "http://example.com/api/v1/user/items{?page,per_page}",
-            "current_user_active_items_url": "http://example.com/api/v1/user/items/active{?page,per_page}",
-            "current_user_completed_items_url": "http://example.com/api/v1/user/items/completed{?page,per_page}",
+            "current_user_items_url": "http://example.com/api/v1/user/items{?page,per_page,cursor,count}",
+            "current_user_active_items_url": "http://example.com/api/v1/user/items/active{?page,per_page,cursor,count}",
+            "current_user_item_changes_url": "http://example.com/api/v1/user/items/changes{?since}",
+            "current_user_items_export_url": "http://example.com/api/v1/user/items/export{?format,done}",
+            "current_user_items_import_url": "http://example.com/api/v1/user/items/import{?format}",
+            "current_user_completed_items_url":
+                "http://example.com/api/v1/user/items/completed{?page,per_page,cursor,count}",
         })
 
 
@@ -43,71 +297,101 @@ class AuthTokenAPI(MethodView):
 
     def post(self):
         grant_type = request.form.get('grant_type')
-        username = request.form.get('username')
-        password = request.form.get('password')
-
-        if grant_type is None or grant_type.lower() != 'password':
-            return api_abort(code=400, message='The grant type must be password.')
-
-        user = User.query.filter_by(username=username).first()
-        if user is None or not user.validate_password(password):
-            return api_abort(code=400, message='Either the username or password was invalid.')
 
-        token, expiration = generate_token(user)
-
-        response = jsonify({
+        if grant_type is not None and grant_type.lower() == 'refresh_token':
+            # the cheap grant: a signature check and one indexed lookup, no password hashing
+            refresh_token = load_refresh_token(request.form.get('refresh_token', ''))
+            user = load_identity(refresh_token.user_id) if refresh_token is not None else None
+            if user is None:
+                count_auth_failure('refresh_token')
+                return api_abort(code=400, message='The refresh token was invalid, expired or revoked.')
+            token, expiration = generate_token(user)
+            refresh = None
+        elif grant_type is not None and grant_type.lower() == 'password':
+            username = request.form.get('username')
+            password = request.form.get('password')
+            user = User.query.filter_by(username=username).first()
+            if user is None or user.expired or not user.validate_password(password):
+                count_auth_failure('password_grant')
+                return api_abort(code=400, message='Either the username or password was invalid.')
+            token, expiration = generate_token(user)
+            refresh = generate_refresh_token(user)
+            db.session.commit()  # also saves an upgraded password hash
+        else:
+            return api_abort(code=400, message='The grant type must be password or refresh_token.')
+
+        data = {
             'access_token': token,
             'token_type': 'Bearer',
             'expires_in': expiration
-        })
+        }
+        if refresh is not None:
+            data['refresh_token'] = refresh
+        response = jsonify(data)
         response.headers['Cache-Control'] = 'no-store'
         response.headers['Pragma'] = 'no-cache'
         return response
 
 
+class RevokeTokenAPI(MethodView):
+
+    def post(self):
+        """Revoke a refresh token, unknown tokens are ignored as RFC 7009 asks."""
+        refresh_token = load_refresh_token(request.form.get('token', ''))
+        if refresh_token is not None:
+            refresh_token.revoked = True
+            db.session.commit()
+        return '', 200
+
+
 class ItemAPI(MethodView):
     decorators = [auth_required]
 
     def get(self, item_id):
         """Get item."""
-        item = Item.query.get_or_404(item_id)
-        if g.current_user != item.author:
-            return api_abort(403)
-        return jsonify(item_schema(item))
+        # look the item up first, a guessed etag must not answer for a missing or foreign item
+        item = Item.query.filter_by(id=item_id, author_id=g.current_user.id).first()
+        if item is None:
+            return item_not_owned(item_id)
+        return render_conditional(item_etag(item_id, g.current_user.item_version), lambda: item_schema(item))
 
     def put(self, item_id):
         """Edit item."""
-        item = Item.query.get_or_404(item_id)
-        if g.current_user != item.author:
-            return api_abort(403)
-        item.body = get_item_body()
+        if not g.current_user.edit_item(item_id, get_item_body(), get_base_version(item_id)):
+            db.session.rollback()  # drop the version bump
+            return item_not_owned(item_id)
         db.session.commit()
-        return '', 204
+        return self.updated(item_id)
 
     def patch(self, item_id):
         """Toggle item."""
-        item = Item.query.get_or_404(item_id)
-        if g.current_user != item.author:
-            return api_abort(403)
-        item.done = not item.done
+        if g.current_user.toggle_item(item_id, get_base_version(item_id)) is None:
+            db.session.rollback()  # drop the version bump
+            return item_not_owned(item_id)
         db.session.commit()
-        return '', 204
+        return self.updated(item_id)
 
     def delete(self, item_id):
         """Delete item."""
-        item = Item.query.get_or_404(item_id)
-        if g.current_user != item.author:
-            return api_abort(403)
-        db.session.delete(item)
+        if not g.current_user.delete_item(item_id, get_base_version(item_id)):
+            db.session.rollback()  # drop the version bump
+            return item_not_owned(item_id)
         db.session.commit()
         return '', 204
 
+    @staticmethod
+    def updated(item_id):
+        response = current_app.response_class(status=204)
+        response.set_etag(item_etag(item_id, g.current_user.item_version))
+        return response
+
 
 class UserAPI(MethodView):
     decorators = [auth_required]
 
     def get(self):
-        return jsonify(user_schema(g.current_user))
+        user = g.current_user
+        return render_conditional('user-%d-%d' % (user.id, user.item_version), lambda: user_schema(user))
 
 
 class ItemsAPI(MethodView):
@@ -115,47 +399,39 @@ class ItemsAPI(MethodView):
 
     def get(self):
         """Get current user's all items."""
-        page = request.args.get('page', 1, type=int)
-        per_page = current_app.config['TODOISM_ITEM_PER_PAGE']
-        pagination = Item.query.with_parent(g.current_user).paginate(page, per_page)
-        items = pagination.items
-        current = url_for('.items', page=page, _external=True)
-        prev = None
-        if pagination.has_prev:
-            prev = url_for('.items', page=page - 1, _external=True)
-        next = None
-        if pagination.has_next:
-            next = url_for('.items', page=page + 1, _external=True)
-        return jsonify(items_schema(items, current, prev, next, pagination))
+        query = Item.query.with_parent(g.current_user)
+        return render_conditional(collection_etag(), lambda: get_items(query, '.items', 'all_item_count'))
 
     def post(self):
         """Create new item."""
-        item = Item(body=get_item_body(), author=g.current_user)
+        g.current_user.bump_item_version()
+        item = Item(body=get_item_body(), author=g.current_user, version=g.current_user.item_version_stamp())
         db.session.add(item)
+        g.current_user.update_item_stats(active=1)
         db.session.commit()
         response = jsonify(item_schema(item))
         response.status_code = 201
         response.headers['Location'] = url_for('.item', item_id=item.id, _external=True)
         return response
 
+    def patch(self):
+        """Mark all current user's items as done or active."""
+        data = request.get_json()
+        if data is None or not isinstance(data.get('done'), bool):
+            raise ValidationError('The done field was missing or invalid.')
+        g.current_user.mark_items(done=data['done'])
+        db.session.commit()
+        return '', 204
+
 
 class ActiveItemsAPI(MethodView):
     decorators = [auth_required]
 
     def get(self):
         """Get current user's active items."""
-        page = request.args.get('page', 1, type=int)
-        pagination = Item.query.with_parent(g.current_user).filter_by(done=False).paginate(
-            page, per_page=current_app.config['TODOISM_ITEM_PER_PAGE'])
-        items = pagination.items
-        current = url_for('.items', page=page, _external=True)
-        prev = None
-        if pagination.has_prev:
-            prev = url_for('.active_items', page=page - 1, _external=True)
-        next = None
-        if pagination.has_next:
-            next = url_for('.active_items', page=page + 1, _external=True)
-        return jsonify(items_schema(items, current, prev, next, pagination))
+        query = Item.query.with_parent(g.current_user).filter_by(done=False)
+        return render_conditional(collection_etag(),
+                                  lambda: get_items(query, '.active_items', 'active_item_count'))
 
 
 class CompletedItemsAPI(MethodView):
@@ -163,30 +439,259 @@ class CompletedItemsAPI(MethodView):
 
     def get(self):
         """Get current user's completed items."""
-        page = request.args.get('page', 1, type=int)
-        pagination = Item.query.with_parent(g.current_user).filter_by(done=True).paginate(
-            page, per_page=current_app.config['TODOISM_ITEM_PER_PAGE'])
-        items = pagination.items
-        current = url_for('.items', page=page, _external=True)
-        prev = None
-        if pagination.has_prev:
-            prev = url_for('.completed_items', page=page - 1, _external=True)
-        next = None
-        if pagination.has_next:
-            next = url_for('.completed_items', page=page + 1, _external=True)
-        return jsonify(items_schema(items, current, prev, next, pagination))
+        query = Item.query.with_parent(g.current_user).filter_by(done=True)
+        return render_conditional(collection_etag(),
+                                  lambda: get_items(query, '.completed_items', 'completed_item_count'))
 
     def delete(self):
         """Clear current user's completed items."""
-        Item.query.with_parent(g.current_user).filter_by(done=True).delete()
-        db.session.commit()  # TODO: is it better use for loop?
+        g.current_user.clear_items()
+        db.session.commit()
         return '', 204
 
 
+class ItemChangesAPI(MethodView):
+    decorators = [auth_required]
+
+    def get(self):
+        """Get the items changed and deleted since a version.
+
+        Clients apply ``deleted`` before ``items``, then keep ``version`` as
+        their next ``since``.
+        """
+        since = request.args.get('since', type=int)
+        if since is None or since < 0:
+            raise ValidationError('The since version was missing or invalid.')
+        user = g.current_user
+        if since < user.compacted_version:
+            return api_abort(410, 'The changes since this version were compacted, fetch all items again.')
+
+        def build():
+            items = user.owned_items().filter(Item.version > since).order_by(Item.version, Item.id)
+            deleted = db.session.query(Tombstone.item_id).filter(
+                Tombstone.author_id == user.id, Tombstone.version > since).order_by(Tombstone.version)
+            return {
+                'self': url_for('.item_changes', since=since, _external=True),
+                'kind': 'ItemChanges',
+                'version': user.item_version,
+                'items': [serialize(item) for item in items],
+                'deleted': [item_id for item_id, in deleted],
+            }
+
+        serialize = ItemSerializer(user, get_fields())
+        return render_conditional(collection_etag(), build)
+
+
+class ItemsExportAPI(MethodView):
+    decorators = [auth_required]
+
+    def get(self):
+        """Stream all current user's items as NDJSON or CSV, optionally only active or completed ones."""
+        format = request.args.get('format', 'ndjson')
+        if format not in EXPORT_FORMATS:
+            raise ValidationError('The format must be ndjson or csv.')
+        query = db.session.query(Item.id, Item.body, Item.done).filter(Item.author_id == g.current_user.id)
+        done = request.args.get('done')
+        if done is not None:
+            if done.lower() not in ('true', 'false'):
+                raise ValidationError('The done filter must be true or false.')
+            query = query.filter(Item.done == (done.lower() == 'true'))
+        # plain tuples fetched in batches through a server-side cursor, no item is kept after it was written
+        rows = query.order_by(Item.id).yield_per(EXPORT_BATCH_SIZE)
+
+        compress = 'gzip' in request.accept_encodings
+        response = current_app.response_class(
+            stream_with_context(export_chunks(export_lines(rows, format), compress)),
+            mimetype=EXPORT_FORMATS[format])
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        response.headers['Content-Disposition'] = 'attachment; filename=items.%s' % format
+        return response
+
+
+class ItemsImportAPI(MethodView):
+    decorators = [auth_required]
+
+    def post(self):
+        """Create items from an NDJSON or CSV body, parsed as it is read and inserted in batches.
+
+        Every batch is committed on its own, so a long import never holds one
+        big transaction. Invalid lines are skipped and reported.
+        """
+        format = request.args.get('format') or IMPORT_FORMATS.get(request.mimetype, 'ndjson')
+        if format not in EXPORT_FORMATS:
+            raise ValidationError('The format must be ndjson or csv.')
+        stream = request.stream
+        if request.content_encoding == 'gzip':
+            stream = gzip.GzipFile(fileobj=stream)
+        lines = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+
+        user = g.current_user
+        batch_size = current_app.config['TODOISM_IMPORT_BATCH_SIZE']
+        insert = Item.__table__.insert().values(author_id=user.id, version=user.item_version_stamp())
+        imported = failed = number = 0
+        errors = []
+        batch = []
+
+        def flush():
+            # one version bump, one executemany, one counter update and one commit per batch
+            user.bump_item_version()
+            db.session.execute(insert, batch)
+            completed = sum(1 for row in batch if row['done'])
+            user.update_item_stats(active=len(batch) - completed, completed=completed)
+            db.session.commit()
+            del batch[:]
+
+        def reject(number, message):
+            nonlocal failed
+            failed += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append({'line': number, 'message': message})
+
+        try:
+            for number, item, error in import_records(lines, format):
+                if item is None:
+                    reject(number, error)
+                    continue
+                batch.append(item)
+                imported += 1
+                if len(batch) >= batch_size:
+                    flush()
+        except (UnicodeDecodeError, OSError, EOFError, zlib.error, csv.Error):
+            # a corrupt or truncated gzip body ends the import like undecodable text
+            reject(number + 1, 'The request body could not be read from this line on.')
+        if batch:
+            flush()
+        return jsonify({'kind': 'ImportResult', 'imported': imported, 'failed': failed, 'errors': errors})
+
+
+class ItemsBatchAPI(MethodView):
+    decorators = [auth_required]
+
+    def post(self):
+        """Apply a batch of create/update/toggle/delete operations in one transaction."""
+        data = request.get_json()
+        if not isinstance(data, dict) or not isinstance(data.get('operations'), list):
+            raise ValidationError('The operations were missing or invalid.')
+        operations = data['operations']
+        if len(operations) > current_app.config['TODOISM_BATCH_LIMIT']:
+            raise ValidationError('Too many operations, the limit is %d.' % current_app.config['TODOISM_BATCH_LIMIT'])
+        mode = data.get('mode', 'atomic')
+        if mode not in ('atomic', 'best_effort'):
+            raise ValidationError('The mode must be atomic or best_effort.')
+
+        user = g.current_user
+        # the bump locks the user row first, every other mutation of this user waits for our commit,
+        # so the state read below stays current until then
+        user.bump_item_version()
+        ids = {op.get('id') for op in operations if isinstance(op, dict) and type(op.get('id')) is int}
+        rows = {}
+        if ids:
+            rows = {item_id: (author_id, done) for item_id, author_id, done in
+                    db.session.query(Item.id, Item.author_id, Item.done).filter(Item.id.in_(ids))}
+
+        # Replay the operations against the loaded state first, so that the
+        # database only sees the net effect as a handful of bulk statements.
+        done_states = {}
+        bodies = {}
+        deleted = set()
+        creates = []
+        results = []
+        for op in operations:
+            result = apply_batch_operation(op, user, rows, done_states, bodies, deleted, creates)
+            results.append(result)
+
+        failed = [result for result in results if result['status'] >= 400]
+        if failed and mode == 'atomic':
+            db.session.rollback()
+            for result in results:
+                if result['status'] < 400:
+                    result.update(status=424, message='Not applied, the batch was rolled back.')
+            return api_abort(400, 'The batch was rolled back, %d operation(s) failed.' % len(failed),
+                             results=results)
+
+        table = Item.__table__
+        version = user.item_version_stamp()
+        if creates:
+            db.session.execute(table.insert().values(done=False, author_id=user.id, version=version),
+                               [dict(body=body) for body, result in creates])
+            # the bump made the version ours alone, so far only the rows inserted above carry it
+            created = db.session.query(Item.id).filter(Item.author_id == user.id, Item.version == version)
+            for (item_id,), (body, result) in zip(created.order_by(Item.id), creates):
+                result['id'] = item_id
+                result['self'] = url_for('.item', item_id=item_id, _external=True)
+        scoped = db.and_(table.c.id == db.bindparam('item_id'), table.c.author_id == user.id)
+        updates = [dict(item_id=item_id, new_body=body) for item_id, body in bodies.items() if item_id not in deleted]
+        if updates:
+            db.session.execute(table.update().where(scoped).values(
+                body=db.bindparam('new_body'), version=version), updates)
+        # an odd number of toggles flips the item, in SQL rather than by writing the state read above
+        toggles = [item_id for item_id, done in done_states.items()
+                   if item_id not in deleted and done != rows[item_id][1]]
+        if toggles:
+            db.session.execute(table.update().where(db.and_(table.c.id.in_(toggles), table.c.author_id == user.id))
+                               .values(done=~table.c.done, version=version))
+        if deleted:
+            db.session.execute(Tombstone.__table__.insert().values(
+                item_id=db.bindparam('item_id'), author_id=user.id, version=version, deleted_at=datetime.utcnow()),
+                [dict(item_id=item_id) for item_id in deleted])
+            db.session.execute(table.delete().where(db.and_(table.c.id.in_(deleted), table.c.author_id == user.id)))
+
+        active = len(creates)
+        completed = 0
+        for item_id, done in done_states.items():
+            was_done = rows[item_id][1]
+            active -= not was_done
+            completed -= was_done
+            if item_id not in deleted:
+                active += not done
+                completed += done
+        user.update_item_stats(active=active, completed=completed)
+        db.session.commit()
+        return jsonify({'kind': 'BatchResult', 'mode': mode, 'results': results})
+
+
+def apply_batch_operation(op, user, rows, done_states, bodies, deleted, creates):
+    """Validate one batch operation and record its effect, return the per-operation result."""
+    if not isinstance(op, dict) or op.get('op') not in ('create', 'update', 'toggle', 'delete'):
+        return {'status': 400, 'message': 'The operation must be create, update, toggle or delete.'}
+    kind = op['op']
+    body = op.get('body')
+    if kind in ('create', 'update') and (not isinstance(body, str) or body.strip() == ''):
+        return {'op': kind, 'status': 400, 'message': 'The item body was empty or invalid.'}
+
+    if kind == 'create':
+        result = {'op': kind, 'status': 201, 'id': None}
+        creates.append((body, result))
+        return result
+
+    item_id = op.get('id')
+    if type(item_id) is not int or item_id not in rows or item_id in deleted:
+        return {'op': kind, 'id': item_id, 'status': 404, 'message': 'Not Found'}
+    author_id, done = rows[item_id]
+    if author_id != user.id:
+        return {'op': kind, 'id': item_id, 'status': 403, 'message': 'Forbidden'}
+
+    done_states.setdefault(item_id, done)
+    if kind == 'update':
+        bodies[item_id] = body
+    elif kind == 'toggle':
+        done_states[item_id] = not done_states[item_id]
+    else:
+        deleted.add(item_id)
+    return {'op': kind, 'id': item_id, 'status': 204}
+
+
 api_v1.add_url_rule('/', view_func=IndexAPI.as_view('index'), methods=['GET'])
 api_v1.add_url_rule('/oauth/token', view_func=AuthTokenAPI.as_view('token'), methods=['POST'])
+api_v1.add_url_rule('/oauth/revoke', view_func=RevokeTokenAPI.as_view('revoke_token'), methods=['POST'])
 api_v1.add_url_rule('/user', view_func=UserAPI.as_view('user'), methods=['GET'])
-api_v1.add_url_rule('/user/items', view_func=ItemsAPI.as_view('items'), methods=['GET', 'POST'])
+api_v1.add_url_rule('/user/items', view_func=ItemsAPI.as_view('items'), methods=['GET', 'POST', 'PATCH'])
+api_v1.add_url_rule('/user/items/changes', view_func=ItemChangesAPI.as_view('item_changes'), methods=['GET'])
+api_v1.add_url_rule('/user/items/export', view_func=ItemsExportAPI.as_view('items_export'), methods=['GET'])
+api_v1.add_url_rule('/user/items/import', view_func=ItemsImportAPI.as_view('items_import'), methods=['POST'])
+api_v1.add_url_rule('/user/items/batch', view_func=ItemsBatchAPI.as_view('items_batch'), methods=['POST'])
 api_v1.add_url_rule('/user/items/<int:item_id>', view_func=ItemAPI.as_view('item'),
                     methods=['GET', 'PUT', 'PATCH', 'DELETE'])
 api_v1.add_url_rule('/user/items/active', view_func=ActiveItemsAPI.as_view('active_items'), methods=['GET'])
@@ -5,9 +5,9 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from flask import url_for
+from flask import url_for, request, g
 
-from todoism.models import Item
+from todoism.apis.v1.errors import ValidationError
 
 
 def user_schema(user):
@@ -19,36 +19,74 @@ def user_schema(user):
         'all_items_url': url_for('.items', _external=True),
         'active_items_url': url_for('.active_items', _external=True),
         'completed_items_url': url_for('.completed_items', _external=True),
-        'all_item_count': len(user.items),
-        'active_item_count': Item.query.with_parent(user).filter_by(done=False).count(),
-        'completed_item_count': Item.query.with_parent(user).filter_by(done=True).count(),
+        'all_item_count': user.all_item_count,
+        'active_item_count': user.active_item_count,
+        'completed_item_count': user.completed_item_count,
     }
 
 
-def item_schema(item):
-    return {
-        'id': item.id,
-        'self': url_for('.item', item_id=item.id, _external=True),
-        'kind': 'Item',
-        'body': item.body,
-        'done': item.done,
-        'author': {
-            'id': 1,
+ITEM_FIELDS = ('id', 'self', 'kind', 'body', 'done', 'author')
+
+
+class ItemSerializer(object):
+    """Serialize items of one author, the URLs are built once instead of twice per item."""
+
+    def __init__(self, author, fields=None):
+        self.fields = fields
+        # item ids are the last path segment, so the URL of item 0 works as a template
+        self.item_url = url_for('.item', item_id=0, _external=True)[:-1] + '%d'
+        self.author = {
+            'id': author.id,
             'url': url_for('.user', _external=True),
-            'username': item.author.username,
+            'username': author.username,
             'kind': 'User',
-        },
-    }
+        }
 
+    def __call__(self, item):
+        schema = {
+            'id': item.id,
+            'self': self.item_url % item.id,
+            'kind': 'Item',
+            'body': item.body,
+            'done': item.done,
+            'author': self.author,
+        }
+        if self.fields is not None:
+            schema = {field: schema[field] for field in self.fields}
+        return schema
 
-def items_schema(items, current, prev, next, pagination):
-    return {
+
+def get_fields():
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    fields = [field.strip() for field in fields.split(',')]
+    for field in fields:
+        if field not in ITEM_FIELDS:
+            raise ValidationError('Unknown field %r, the fields must be in %s.' % (field, ', '.join(ITEM_FIELDS)))
+    return fields
+
+
+def item_schema(item):
+    return ItemSerializer(item.author, get_fields())(item)
+
+
+def items_schema(items, current, prev, next, pagination=None, count=None, first=None):
+    """Page-number collections carry ``pagination``, cursor collections only report ``count`` if it was given."""
+    # every item of a collection belongs to the current user, so one serializer serves them all
+    serialize = ItemSerializer(g.current_user, get_fields())
+    schema = {
         'self': current,
         'kind': 'ItemCollection',
-        'items': [item_schema(item) for item in items],
+        'items': [serialize(item) for item in items],
         'prev': prev,
-        'last': url_for('.items', page=pagination.pages, _external=True),
-        'first': url_for('.items', page=1, _external=True),
+        'first': first,
         'next': next,
-        'count': pagination.total
     }
+    if pagination is not None:
+        schema['last'] = url_for('.items', page=pagination.pages, _external=True)
+        schema['first'] = url_for('.items', page=1, _external=True)
+        schema['count'] = pagination.total
+    elif count is not None:
+        schema['count'] = count
+    return schema
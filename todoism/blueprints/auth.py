@@ -5,19 +5,21 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from faker import Faker
 from flask import render_template, redirect, url_for, Blueprint, request, jsonify
-from flask_babel import _
+from flask_babel import _, get_locale
 from flask_login import login_user, logout_user, login_required, current_user
 
+from todoism.demo import claim_demo_account, create_demo_accounts
 from todoism.extensions import db
-from todoism.models import User, Item
+from todoism.metrics import count_auth_failure
+from todoism.models import User
+from todoism.pages import cached_page
 
 auth_bp = Blueprint('auth', __name__)
-fake = Faker()
 
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
+@cached_page()
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('todo.app'))
@@ -29,9 +31,11 @@ def login():
 
         user = User.query.filter_by(username=username).first()
 
-        if user is not None and user.validate_password(password):
+        if user is not None and not user.expired and user.validate_password(password):
+            db.session.commit()  # save an upgraded password hash
             login_user(user)
             return jsonify(message=_('Login success.'))
+        count_auth_failure('login')
         return jsonify(message=_('Invalid username or password.')), 400
     return render_template('_login.html')
 
@@ -45,22 +49,10 @@ def logout():
 
 @auth_bp.route('/register')
 def register():
-    # generate a random account for demo use
-    username = fake.user_name()
-    # make sure the generated username was not in database
-    while User.query.filter_by(username=username).first() is not None:
-        username = fake.user_name()
-    password = fake.word()
-    user = User(username=username)
-    user.set_password(password)
-    db.session.add(user)
+    # hand out a pre-generated account, only generate one here when the pool ran dry
+    account = claim_demo_account(str(get_locale()))
+    if account is None:
+        account = create_demo_accounts(1)[0]
     db.session.commit()
-
-    item = Item(body=_('Witness something truly majestic'), author=user)
-    item2 = Item(body=_('Help a complete stranger'), author=user)
-    item3 = Item(body=_('Drive a motorcycle on the Great Wall of China'), author=user)
-    item4 = Item(body=_('Sit on the Great Egyptian Pyramids'), done=True, author=user)
-    db.session.add_all([item, item2, item3, item4])
-    db.session.commit()
-
+    username, password = account
     return jsonify(username=username, password=password, message=_('Generate success.'))
@@ -10,16 +10,19 @@ from flask_babel import _
 from flask_login import current_user
 
 from todoism.extensions import db
+from todoism.pages import cached_page, CSRF_PLACEHOLDER
 
 home_bp = Blueprint('home', __name__)
 
 
 @home_bp.route('/')
+@cached_page(csrf=True)
 def index():
-    return render_template('index.html')
+    return render_template('index.html', csrf_token=lambda: CSRF_PLACEHOLDER)
 
 
 @home_bp.route('/intro')
+@cached_page()
 def intro():
     return render_template('_intro.html')
 
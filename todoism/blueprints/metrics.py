@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import hmac
+
+from flask import Blueprint, abort, current_app, request
+
+from todoism.metrics import get_registry, render
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+def scrape_allowed():
+    """The scraper must send the configured token as a bearer token, without a token nobody may scrape.
+
+    Trusting localhost instead is an opt-in, since behind a reverse proxy on the
+    same host every public request comes from localhost too. Proxied requests
+    are refused even then.
+    """
+    token = current_app.config['TODOISM_METRICS_TOKEN']
+    if token:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer %s' % token)
+    return (current_app.config['TODOISM_METRICS_ALLOW_LOCALHOST'] and 'X-Forwarded-For' not in request.headers
+            and request.remote_addr in ('127.0.0.1', '::1'))
+
+
+@metrics_bp.route('/metrics')
+def metrics():
+    # a 404 rather than a 403, the endpoint isn't advertised to the public
+    if 'todoism_metrics' not in current_app.extensions or not scrape_allowed():
+        abort(404)
+    response = current_app.response_class(render(get_registry().collect()),
+                                          content_type='text/plain; version=0.0.4; charset=utf-8')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
@@ -5,24 +5,114 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from flask import render_template, request, Blueprint, jsonify
-from flask_babel import _
+from flask import render_template, request, Blueprint, jsonify, abort, current_app, url_for
+from flask_babel import _, get_locale
 from flask_login import current_user, login_required
+from markupsafe import Markup
 
+from todoism.cache import get_fragment_cache
 from todoism.extensions import db
 from todoism.models import Item
 
 todo_bp = Blueprint('todo', __name__)
 
+# item ids per query when loading the items that missed the fragment cache
+FRAGMENT_LOAD_CHUNK = 500
+
+
+def render_item(item):
+    """Render an item with ``_item.html``, reusing the fragment cached for its version and the current locale."""
+    cache = get_fragment_cache()
+    key = (item.id, str(get_locale()))
+    fragment = cache.get(key, item.version)
+    if fragment is None:
+        fragment = render_template('_item.html', item=item)
+        cache.set(key, item.version, fragment)
+    return Markup(fragment)
+
+
+def render_items(rows):
+    """Render items given as ``(id, version)`` rows, only the items missing from the fragment cache are loaded."""
+    cache = get_fragment_cache()
+    locale = str(get_locale())
+    fragments = [cache.get((item_id, locale), version) for item_id, version in rows]
+    missing = [item_id for (item_id, version), fragment in zip(rows, fragments) if fragment is None]
+    rendered = {}
+    for start in range(0, len(missing), FRAGMENT_LOAD_CHUNK):
+        for item in Item.query.filter(Item.id.in_(missing[start:start + FRAGMENT_LOAD_CHUNK])):
+            rendered[item.id] = render_template('_item.html', item=item)
+            cache.set((item.id, locale), item.version, rendered[item.id])
+    return [Markup(fragment if fragment is not None else rendered[item_id])
+            for (item_id, version), fragment in zip(rows, fragments)
+            if fragment is not None or item_id in rendered]
+
+
+def get_window(after, *columns):
+    """Query the window of own items that follows the item ``after``, return the rows and the next URL.
+
+    The first column must be ``Item.id``.
+    """
+    size = current_app.config['TODOISM_APP_WINDOW_SIZE']
+    rows = Item.query.with_parent(current_user).filter(Item.id > after).with_entities(
+        *columns).order_by(Item.id).limit(size + 1).all()
+    next_url = None
+    if len(rows) > size:
+        next_url = url_for('.items', after=rows[size - 1][0])
+    return rows[:size], next_url
+
+
+def render_window(after=0):
+    """Render the window of own items that follows the item ``after``, return the fragments and the next URL."""
+    rows, next_url = get_window(after, Item.id, Item.version)
+    return render_items(rows), next_url
+
+
+def item_counts():
+    """The counters the client shows, sent with every response that changes them."""
+    return dict(all=current_user.all_item_count, active=current_user.active_item_count,
+                completed=current_user.completed_item_count)
+
+
+def forget_item(item_id):
+    """Drop the cached fragments of a changed or deleted item.
+
+    Bulk changes don't call this, their stale fragments fail the version
+    check and age out of the cache.
+    """
+    cache = get_fragment_cache()
+    for locale in current_app.config['TODOISM_LOCALES']:
+        cache.delete((item_id, locale))
+
+
+def item_not_owned(item_id):
+    """Respond to a scoped statement that matched no row: 404 if the item is missing, 403 otherwise."""
+    if not Item.exists(item_id):
+        abort(404)
+    return jsonify(message=_('Permission denied.')), 403
+
 
 @todo_bp.route('/app')
 @login_required
 def app():
-    all_count = Item.query.with_parent(current_user).count()
-    active_count = Item.query.with_parent(current_user).filter_by(done=False).count()
-    completed_count = Item.query.with_parent(current_user).filter_by(done=True).count()
-    return render_template('_app.html', items=current_user.items,
-                           all_count=all_count, active_count=active_count, completed_count=completed_count)
+    fragments, next_url = render_window()
+    # with client rendering, the client builds new items from this placeholder
+    placeholder = dict(id=0, body='', done=False) if current_app.config['TODOISM_CLIENT_RENDERING'] else None
+    return render_template('_app.html', fragments=fragments, next_url=next_url, placeholder=placeholder,
+                           all_count=current_user.all_item_count,
+                           active_count=current_user.active_item_count,
+                           completed_count=current_user.completed_item_count)
+
+
+@todo_bp.route('/items')
+@login_required
+def items():
+    after = request.args.get('after', 0, type=int)
+    if current_app.config['TODOISM_CLIENT_RENDERING']:
+        rows, next_url = get_window(after, Item.id, Item.body, Item.done)
+        items = [dict(id=item_id, body=body, done=done) for item_id, body, done in rows]
+        return jsonify(items=items, next=next_url)
+    fragments, next_url = render_window(after)
+    return jsonify(html=''.join(fragments), next=next_url)
 
 
 @todo_bp.route('/items/new', methods=['POST'])
@@ -31,56 +121,74 @@ def new_item():
     data = request.get_json()
     if data is None or data['body'].strip() == '':
         return jsonify(message=_('Invalid item body.')), 400
-    item = Item(body=data['body'], author=current_user._get_current_object())
+    current_user.bump_item_version()
+    item = Item(body=data['body'], author=current_user._get_current_object(),
+                version=current_user.item_version_stamp())
     db.session.add(item)
+    current_user.update_item_stats(active=1)  # flushes the item, so its id is known
+    if current_app.config['TODOISM_CLIENT_RENDERING']:
+        item_data = dict(id=item.id, body=data['body'], done=False)
+        db.session.commit()
+        return jsonify(item=item_data, message='+1', counts=item_counts())
     db.session.commit()
-    return jsonify(html=render_template('_item.html', item=item), message='+1')
+    return jsonify(html=render_item(item), message='+1', counts=item_counts())
 
 
 @todo_bp.route('/item/<int:item_id>/edit', methods=['PUT'])
 @login_required
 def edit_item(item_id):
-    item = Item.query.get_or_404(item_id)
-    if current_user != item.author:
-        return jsonify(message=_('Permission denied.')), 403
-
     data = request.get_json()
     if data is None or data['body'].strip() == '':
         return jsonify(message=_('Invalid item body.')), 400
-    item.body = data['body']
+    if not current_user.edit_item(item_id, data['body']):
+        db.session.rollback()  # drop the version bump
+        return item_not_owned(item_id)
     db.session.commit()
+    forget_item(item_id)
     return jsonify(message=_('Item updated.'))
 
 
 @todo_bp.route('/item/<int:item_id>/toggle', methods=['PATCH'])
 @login_required
 def toggle_item(item_id):
-    item = Item.query.get_or_404(item_id)
-    if current_user != item.author:
-        return jsonify(message=_('Permission denied.')), 403
-
-    item.done = not item.done
+    if current_user.toggle_item(item_id) is None:
+        db.session.rollback()  # drop the version bump
+        return item_not_owned(item_id)
     db.session.commit()
-    return jsonify(message=_('Item toggled.'))
+    forget_item(item_id)
+    return jsonify(message=_('Item toggled.'), counts=item_counts())
 
 
 @todo_bp.route('/item/<int:item_id>/delete', methods=['DELETE'])
 @login_required
 def delete_item(item_id):
-    item = Item.query.get_or_404(item_id)
-    if current_user != item.author:
-        return jsonify(message=_('Permission denied.')), 403
-
-    db.session.delete(item)
+    if not current_user.delete_item(item_id):
+        db.session.rollback()  # drop the version bump
+        return item_not_owned(item_id)
     db.session.commit()
-    return jsonify(message=_('Item deleted.'))
+    forget_item(item_id)
+    return jsonify(message=_('Item deleted.'), counts=item_counts())
 
 
 @todo_bp.route('/item/clear', methods=['DELETE'])
 @login_required
 def clear_items():
-    items = Item.query.with_parent(current_user).filter_by(done=True).all()
-    for item in items:
-        db.session.delete(item)
+    current_user.clear_items()
+    db.session.commit()
+    return jsonify(message=_('All clear!'), counts=item_counts())
+
+
+@todo_bp.route('/items/complete', methods=['PATCH'])
+@login_required
+def complete_items():
+    current_user.mark_items(done=True)
+    db.session.commit()
+    return jsonify(message=_('All items marked as done.'), counts=item_counts())
+
+
+@todo_bp.route('/items/activate', methods=['PATCH'])
+@login_required
+def activate_items():
+    current_user.mark_items(done=False)
     db.session.commit()
-    return jsonify(message=_('All clear!'))
+    return jsonify(message=_('All items marked as active.'), counts=item_counts())
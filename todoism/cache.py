@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app
+from sqlalchemy.orm import make_transient_to_detached
+
+from todoism.extensions import db
+
+# columns that identify a user and rarely change, the counters and versions are never cached
+IDENTITY_COLUMNS = ('id', 'username', 'locale', 'expires_at')
+
+
+class LRUCache(object):
+    """A thread-safe, size-bounded LRU mapping whose entries expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, expires = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl or ttl)
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class FragmentCache(object):
+    """A thread-safe LRU cache of rendered fragments, bounded both in entries and in characters.
+
+    An entry is stored with the version it was rendered from, a lookup with
+    another version is a miss, so a stale fragment is never served even if
+    an invalidation was missed.
+    """
+
+    def __init__(self, maxsize=1024, maxchars=None):
+        self.maxsize = maxsize
+        self.maxchars = maxchars
+        self.chars = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, version, fragment):
+        if self.maxsize <= 0 or (self.maxchars is not None and len(fragment) > self.maxchars):
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (version, fragment)
+            self.chars += len(fragment)
+            while len(self._data) > self.maxsize or (self.maxchars is not None and self.chars > self.maxchars):
+                self.chars -= len(self._data.popitem(last=False)[1][1])
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.chars -= len(entry[1])
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.chars = 0
+
+    def stats(self):
+        return dict(entries=len(self._data), chars=self.chars, hits=self.hits, misses=self.misses)
+
+
+def init_cache(app):
+    size = app.config['TODOISM_IDENTITY_CACHE_SIZE']
+    ttl = app.config['TODOISM_IDENTITY_CACHE_TTL']
+    app.extensions['todoism_identity_cache'] = LRUCache(size, ttl)
+    app.extensions['todoism_token_cache'] = LRUCache(size, ttl)
+    app.extensions['todoism_fragment_cache'] = FragmentCache(app.config['TODOISM_FRAGMENT_CACHE_SIZE'],
+                                                             app.config['TODOISM_FRAGMENT_CACHE_CHARS'])
+
+
+def get_identity_cache():
+    return current_app.extensions['todoism_identity_cache']
+
+
+def get_token_cache():
+    return current_app.extensions['todoism_token_cache']
+
+
+def get_fragment_cache():
+    return current_app.extensions['todoism_fragment_cache']
+
+
+def load_identity(user_id):
+    """Return the user attached to the current session, without a query if its identity is cached.
+
+    Returns None if the user doesn't exist or its demo account expired, which
+    ends its sessions and invalidates its tokens before the reaper runs. The
+    counters and versions of a cached user are left unloaded, they are fetched
+    with one query the first time the request touches them.
+    """
+    from todoism.models import User
+
+    identity = get_identity_cache().get(user_id)
+    if identity is None:
+        user = User.query.get(user_id)
+        if user is not None:
+            get_identity_cache().set(user_id, {column: getattr(user, column) for column in IDENTITY_COLUMNS})
+    else:
+        user = User(**identity)
+        make_transient_to_detached(user)
+        user = db.session.merge(user, load=False)
+    if user is None or user.expired:
+        return None
+    return user
+
+
+def forget_identity(user_id):
+    """Drop a user from the identity cache of this process, call it when the user changes or is deleted."""
+    if user_id is not None and current_app:
+        get_identity_cache().delete(user_id)
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+from functools import partial
+
+from flask import _request_ctx_stack
+from werkzeug.local import LocalProxy
+
+
+class LazyContext(object):
+    """A registry of template context values that are computed on first use and memoized per request.
+
+    Templates get a proxy for every registered value, so a template that
+    doesn't use a value never pays for it::
+
+        @template_context.value('active_items')
+        def active_items():
+            return current_user.active_item_count
+    """
+
+    def __init__(self):
+        self.factories = {}
+
+    def value(self, name):
+        def decorator(func):
+            self.factories[name] = func
+            return func
+        return decorator
+
+    def resolve(self, name):
+        ctx = _request_ctx_stack.top
+        if ctx is None:
+            return self.factories[name]()
+        # kept on the request context rather than on g, which may outlive the request
+        memo = getattr(ctx, 'todoism_template_context', None)
+        if memo is None:
+            memo = ctx.todoism_template_context = {}
+        if name not in memo:
+            memo[name] = self.factories[name]()
+        return memo[name]
+
+    def processor(self):
+        return {name: LocalProxy(partial(self.resolve, name)) for name in self.factories}
+
+
+template_context = LazyContext()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import random
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_babel import _, force_locale
+
+from todoism.extensions import db
+from todoism.cache import forget_identity
+from todoism.models import User, Item, Tombstone, RefreshToken
+
+# how many pooled accounts a claim tries before falling back to creating one
+CLAIM_CANDIDATES = 8
+
+
+def seed_items():
+    """The items every demo account starts with, in the current locale, as ``(body, done)`` pairs."""
+    return [
+        (_('Witness something truly majestic'), False),
+        (_('Help a complete stranger'), False),
+        (_('Drive a motorcycle on the Great Wall of China'), False),
+        (_('Sit on the Great Egyptian Pyramids'), True),
+    ]
+
+
+def demo_expires_at():
+    return datetime.utcnow() + timedelta(days=current_app.config['TODOISM_DEMO_ACCOUNT_DAYS'])
+
+
+def generate_usernames(fake, count):
+    """Generate ``count`` unused usernames, checking each batch of candidates with one query."""
+    usernames = set()
+    while len(usernames) < count:
+        candidates = {fake.user_name() for i in range(count - len(usernames))} - usernames
+        taken = {username for username, in db.session.query(User.username).filter(User.username.in_(candidates))}
+        usernames |= candidates - taken
+    return list(usernames)
+
+
+def create_demo_accounts(count, pool_locale=None):
+    """Add ``count`` demo accounts with their seed items to the session, return ``(username, password)`` pairs.
+
+    Accounts created with a ``pool_locale`` wait in the pool until they are
+    claimed, their seed items are translated to that locale. Their expiry
+    only starts counting when they are claimed.
+    """
+    from faker import Faker  # only needed to fill the pool and when it runs dry
+
+    fake = Faker()
+    seeds = seed_items()
+    active = sum(1 for body, done in seeds if not done)
+    accounts = []
+    users = []
+    for username in generate_usernames(fake, count):
+        password = fake.word()
+        user = User(username=username, pool_locale=pool_locale, demo_password=password if pool_locale else None,
+                    expires_at=None if pool_locale else demo_expires_at(),
+                    all_item_count=len(seeds), active_item_count=active,
+                    completed_item_count=len(seeds) - active, item_version=1)
+        user.set_password(password)
+        accounts.append((username, password))
+        users.append(user)
+    db.session.add_all(users)
+    db.session.flush()
+    db.session.execute(Item.__table__.insert(), [
+        dict(body=body, done=done, author_id=user.id, version=1) for user in users for body, done in seeds])
+    return accounts
+
+
+def claim_demo_account(locale):
+    """Take a pooled account of the given locale with one conditional UPDATE, return None if the pool is empty."""
+    candidates = db.session.query(User.id, User.username, User.demo_password).filter_by(
+        pool_locale=locale).limit(CLAIM_CANDIDATES).all()
+    # concurrent claims start from different candidates, so they rarely race for the same row
+    random.shuffle(candidates)
+    for user_id, username, password in candidates:
+        if User.query.filter_by(id=user_id, pool_locale=locale).update(
+                {'pool_locale': None, 'demo_password': None, 'expires_at': demo_expires_at()},
+                synchronize_session=False):
+            return username, password
+    return None
+
+
+def fill_demo_pool(size, locale):
+    """Top up the pool of the given locale to ``size`` accounts, return the number of created accounts."""
+    missing = size - User.query.filter_by(pool_locale=locale).count()
+    if missing <= 0:
+        return 0
+    with force_locale(locale):
+        create_demo_accounts(missing, pool_locale=locale)
+    db.session.commit()
+    return missing
+
+
+def reap_demo_accounts(chunk_size):
+    """Delete expired demo accounts and everything they own, ``chunk_size`` accounts per transaction.
+
+    Each chunk is removed with a few set-based DELETEs and committed on its
+    own, so the write lock is never held for longer than one chunk. Return
+    the number of deleted rows per table.
+    """
+    reaped = dict(user=0, item=0, tombstone=0, refresh_token=0)
+    while True:
+        user_ids = [user_id for user_id, in db.session.query(User.id).filter(
+            User.expires_at < datetime.utcnow()).limit(chunk_size)]
+        if not user_ids:
+            return reaped
+        # the foreign keys would cascade, deleting the children explicitly tells how many rows went away
+        for table, model, column in (('item', Item, Item.author_id),
+                                     ('tombstone', Tombstone, Tombstone.author_id),
+                                     ('refresh_token', RefreshToken, RefreshToken.user_id)):
+            reaped[table] += model.query.filter(column.in_(user_ids)).delete(synchronize_session=False)
+        reaped['user'] += User.query.filter(User.id.in_(user_ids)).delete(synchronize_session=False)
+        db.session.commit()
+        for user_id in user_ids:
+            forget_identity(user_id)
@@ -5,11 +5,17 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
+import sqlite3
+
 from flask import request, current_app
 from flask_babel import Babel, lazy_gettext as _l
 from flask_login import LoginManager, current_user
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf.csrf import CSRFProtect
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from todoism.instrument import timed
 
 db = SQLAlchemy()
 csrf = CSRFProtect()
@@ -22,8 +28,18 @@ login_manager.login_message = _l('Please login to access this page.')
 
 @login_manager.user_loader
 def load_user(user_id):
-    from todoism.models import User
-    return User.query.get(int(user_id))
+    from todoism.cache import load_identity
+    with timed('auth'):
+        return load_identity(int(user_id))
+
+
+@event.listens_for(Engine, 'connect')
+def enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    # SQLite ignores ON DELETE CASCADE unless foreign keys are turned on per connection
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
 
 
 @babel.localeselector
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import random
+from datetime import datetime
+
+from todoism.extensions import db
+from todoism.models import User, Item
+from todoism.passwords import get_hasher
+
+WORDS = ('buy', 'milk', 'call', 'mom', 'read', 'book', 'write', 'report', 'fix', 'bike', 'plan', 'trip',
+         'clean', 'kitchen', 'pay', 'bills', 'water', 'plants', 'learn', 'flask', 'walk', 'dog', 'cook', 'dinner')
+
+
+def bind_value(column, value):
+    """Convert a value the way SQLAlchemy would before handing it to the driver."""
+    dialect = db.session.connection().dialect
+    processor = column.type.dialect_impl(dialect).bind_processor(dialect)
+    return processor(value) if processor is not None else value
+
+
+def insert_rows(table, columns, rows):
+    """Insert tuples of driver-ready values with one executemany on the DBAPI cursor.
+
+    This skips the per-row parameter processing of Core, which dominates a
+    bulk load, so values like dates must go through :func:`bind_value` first.
+    """
+    connection = db.session.connection()
+    compiled = table.insert().compile(dialect=connection.dialect, column_keys=columns)
+    if compiled.positional:
+        order = [columns.index(name) for name in compiled.positiontup]
+        rows = [tuple(row[i] for i in order) for row in rows] if order != list(range(len(columns))) else rows
+    else:
+        rows = [dict(zip(columns, row)) for row in rows]
+    cursor = connection.connection.cursor()
+    try:
+        cursor.executemany(str(compiled), rows)
+    finally:
+        cursor.close()
+
+
+def forge(users, items_per_user, done_ratio=0.2, seed=42, batch_size=10000, password='123', defer_indexes=False):
+    """Insert fake users with their items using batched Core executemany, return the forged user ids.
+
+    The output only depends on ``seed``. All users share one password, so
+    it is hashed once. Usernames are ``forge<n>``, numbered after the
+    users that are already there. With ``defer_indexes`` the item indexes
+    are dropped during the load and built once at the end, in the same
+    transaction.
+    """
+    connection = db.session.connection()
+    indexes = list(Item.__table__.indexes) if defer_indexes else []
+    for index in indexes:
+        index.drop(connection)
+
+    rng = random.Random(seed)
+    # item bodies are picked from a pool, composing one per item costs more than inserting it
+    bodies = [' '.join(rng.sample(WORDS, 3)).capitalize() for i in range(1024)]
+    password_hash = get_hasher().hash(password)
+    now = datetime.utcnow()
+    item_now = bind_value(Item.__table__.c.updated_at, now)
+    first = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+    user_ids = []
+    # enough users per round that a round inserts about batch_size items
+    users_per_batch = max(1, batch_size // max(items_per_user, 1))
+    for start in range(first, first + users, users_per_batch):
+        usernames = ['forge%d' % number for number in range(start, min(start + users_per_batch, first + users))]
+        # generated user by user, so the data doesn't depend on the batch size
+        user_items = [[(bodies[rng.getrandbits(10)], rng.random() < done_ratio) for i in range(items_per_user)]
+                      for username in usernames]
+        db.session.execute(User.__table__.insert(), [
+            dict(username=username, password_hash=password_hash, created_at=now, all_item_count=len(items),
+                 active_item_count=sum(not done for body, done in items),
+                 completed_item_count=sum(done for body, done in items),
+                 item_version=1, items_updated_at=now, compacted_version=0)
+            for username, items in zip(usernames, user_items)])
+        ids = dict(db.session.query(User.username, User.id).filter(User.username.in_(usernames)))
+        columns = ['body', 'done', 'version', 'updated_at', 'author_id']
+        rows = []
+        for username, items in zip(usernames, user_items):
+            user_id = ids[username]
+            user_ids.append(user_id)
+            rows.extend((body, done, 1, item_now, user_id) for body, done in items)
+            if len(rows) >= batch_size:
+                insert_rows(Item.__table__, columns, rows)
+                rows = []
+        if rows:
+            insert_rows(Item.__table__, columns, rows)
+    for index in indexes:
+        index.create(connection)
+    db.session.commit()
+    return user_ids
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager
+
+from flask import _request_ctx_stack, request, request_started, request_finished, before_render_template, \
+    template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('todoism.instrument')
+
+METRICS = ('db', 'tpl', 'auth')
+
+
+class QueryLimitExceeded(Exception):
+    """Raised in testing when a request runs more queries than the limit of its endpoint."""
+
+
+class Timings(object):
+    """Query count and the time spent in the database, templates and authentication during one request.
+
+    Nested measurements of the same metric, like a fragment rendered inside a
+    page, are only counted once.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.durations = dict.fromkeys(METRICS, 0.0)
+        self._running = {}
+
+    def start(self, name):
+        depth, started = self._running.get(name, (0, None))
+        self._running[name] = (depth + 1, started if depth else time.perf_counter())
+
+    def stop(self, name):
+        if name not in self._running:
+            return
+        depth, started = self._running.pop(name)
+        if depth > 1:
+            self._running[name] = (depth - 1, started)
+        else:
+            self.durations[name] += time.perf_counter() - started
+
+    def server_timing(self, total):
+        metrics = ['%s;dur=%.2f' % (name, self.durations[name] * 1000) for name in METRICS]
+        metrics[0] += ';desc="%d queries"' % self.queries
+        metrics.append('total;dur=%.2f' % (total * 1000))
+        return ', '.join(metrics)
+
+
+def get_timings():
+    """Timings of the current request, None when instrumentation is off or outside of a request."""
+    ctx = _request_ctx_stack.top
+    return getattr(ctx, 'todoism_timings', None)
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to a metric of the current request, usable as a decorator too."""
+    timings = get_timings()
+    if timings is None:
+        yield
+        return
+    timings.start(name)
+    try:
+        yield
+    finally:
+        timings.stop(name)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = get_timings()
+    if timings is not None:
+        timings.queries += 1
+        timings.start('db')
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = get_timings()
+    if timings is not None:
+        timings.stop('db')
+
+
+def handle_error(exception_context):
+    # a failed query never reaches after_cursor_execute
+    after_cursor_execute(None, None, None, None, None, None)
+
+
+def start_request(app, **extra):
+    _request_ctx_stack.top.todoism_timings = Timings()
+
+
+def start_template(app, template, context, **extra):
+    timings = get_timings()
+    if timings is not None:
+        timings.start('tpl')
+
+
+def stop_template(app, template, context, **extra):
+    timings = get_timings()
+    if timings is not None:
+        timings.stop('tpl')
+
+
+def finish_request(app, response, **extra):
+    """Report the timings in a Server-Timing header and a log line, then check the query limit.
+
+    A streamed body runs after this point, its queries are not counted.
+    """
+    timings = get_timings()
+    if timings is None:
+        return
+    total = time.perf_counter() - timings.started
+    response.headers['Server-Timing'] = timings.server_timing(total)
+    endpoint = request.endpoint
+    record = dict(endpoint=endpoint, method=request.method, status=response.status_code,
+                  queries=timings.queries, total_ms=round(total * 1000, 2),
+                  **{'%s_ms' % name: round(timings.durations[name] * 1000, 2) for name in METRICS})
+    logger.info(json.dumps(record, sort_keys=True))
+
+    limit = app.config['TODOISM_QUERY_LIMITS'].get(endpoint)
+    if limit is not None and timings.queries > limit:
+        message = '%s ran %d queries, its limit is %d.' % (endpoint, timings.queries, limit)
+        if app.testing:
+            raise QueryLimitExceeded(message)
+        logger.warning(message)
+
+
+def init_instrumentation(app):
+    if not app.config['TODOISM_INSTRUMENT']:
+        return
+    # the engine hooks are global, they do nothing for requests that no instrumented app started
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(Engine, 'handle_error', handle_error)
+    request_started.connect(start_request, app)
+    before_render_template.connect(start_template, app)
+    template_rendered.connect(stop_template, app)
+    request_finished.connect(finish_request, app)
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import json
+import math
+import os
+import random
+import re
+import time
+from http.cookiejar import CookieJar
+from json import dumps  # the request methods take a json argument, like the test client
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import build_opener, HTTPCookieProcessor, Request
+
+WORKLOADS = ('login', 'app', 'create', 'toggle', 'edit', 'delete', 'api')
+DEFAULT_MIX = 'login=1,app=3,create=2,toggle=2,edit=1,delete=1,api=2'
+# upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf'))
+
+
+def parse_mix(mix):
+    """Parse ``name=weight,...`` into a dict of workload weights."""
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in WORKLOADS:
+            raise ValueError('Unknown workload %r, the workloads are %s.' % (name, ', '.join(WORKLOADS)))
+        try:
+            weights[name] = float(weight or 1)
+        except ValueError:
+            raise ValueError('The weight of %s must be a number.' % name)
+    return weights
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of a sorted list."""
+    index = max(0, min(len(values) - 1, int(math.ceil(percent / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+class WSGIClient(object):
+    """Sends requests to the app in this process through the test client."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, json=None, data=None, headers=None):
+        response = self.client.open(path, method=method, json=json, data=data, headers=headers)
+        return response.status_code, response.get_data()
+
+
+class HTTPClient(object):
+    """Sends requests to a running server, keeping its cookies like a browser."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+
+    def request(self, method, path, json=None, data=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if json is not None:
+            body = dumps(json).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = urlencode(data).encode('utf-8')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        request = Request(self.url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(request) as response:
+                return response.status, response.read()
+        except HTTPError as e:
+            return e.code, e.read()
+
+
+class Worker(object):
+    """Plays one user: logs in, then runs workloads picked at random by weight."""
+
+    def __init__(self, client, username, password, seed):
+        self.client = client
+        self.username = username
+        self.password = password
+        self.random = random.Random(seed)
+        self.item_ids = []
+        self.cursor = ''
+        self.csrf_token = None
+        self.token = None
+        self.logged_in = False
+
+    def call(self, method, path, **kwargs):
+        headers = kwargs.pop('headers', {})
+        if self.csrf_token and not path.startswith('/api'):
+            headers['X-CSRFToken'] = self.csrf_token
+        return self.client.request(method, path, headers=headers, **kwargs)
+
+    def start(self):
+        status, body = self.call('GET', '/')
+        match = re.search(br'var csrf_token = "([^"]*)"', body)
+        self.csrf_token = match.group(1).decode('utf-8') if match else None
+        self.login()
+        status, body = self.call('POST', '/api/v1/oauth/token', data=dict(
+            grant_type='password', username=self.username, password=self.password))
+        if status == 200:
+            self.token = json.loads(body.decode('utf-8'))['access_token']
+
+    def login(self):
+        """Log out first, a logged in user is redirected without its password being checked."""
+        if self.logged_in:
+            self.call('GET', '/logout')
+        status, body = self.call('POST', '/login', json=dict(username=self.username, password=self.password))
+        self.logged_in = status == 200
+        return status, body
+
+    def app(self):
+        return self.call('GET', '/app')
+
+    def create(self):
+        status, body = self.call('POST', '/items/new', json=dict(body='Load test item'))
+        if status == 200:
+            data = json.loads(body.decode('utf-8'))
+            if 'item' in data:
+                self.item_ids.append(data['item']['id'])
+            else:
+                self.item_ids.append(int(re.search(r'data-id="(\d+)"', data['html']).group(1)))
+        return status, body
+
+    def own_item(self):
+        if not self.item_ids:
+            self.create()
+        return self.random.choice(self.item_ids) if self.item_ids else 0
+
+    def toggle(self):
+        return self.call('PATCH', '/item/%d/toggle' % self.own_item())
+
+    def edit(self):
+        return self.call('PUT', '/item/%d/edit' % self.own_item(), json=dict(body='Edited load test item'))
+
+    def delete(self):
+        item_id = self.own_item()
+        if item_id in self.item_ids:
+            self.item_ids.remove(item_id)
+        return self.call('DELETE', '/item/%d/delete' % item_id)
+
+    def api(self):
+        """Fetch the next page of the item collection, starting over after the last one."""
+        status, body = self.call('GET', '/api/v1/user/items?cursor=' + self.cursor,
+                                 headers={'Authorization': 'Bearer %s' % self.token})
+        if status == 200:
+            next_url = json.loads(body.decode('utf-8'))['next']
+            self.cursor = next_url.split('cursor=')[1].split('&')[0] if next_url else ''
+        return status, body
+
+
+def play(client, username, password, weights, requests, duration, seed):
+    """Run the workloads of one user, return its ``(workload, status, start, latency)`` samples.
+
+    Stops after ``requests`` requests, or after ``duration`` seconds if it is set.
+    """
+    worker = Worker(client, username, password, seed)
+    worker.start()
+    names = sorted(weights)
+    relative = [weights[name] for name in names]
+    deadline = time.time() + duration if duration else None
+    samples = []
+    while (time.time() < deadline) if deadline is not None else (len(samples) < requests):
+        name = worker.random.choices(names, relative)[0]
+        start = time.time()
+        try:
+            status, body = getattr(worker, name)()
+        except Exception:  # a dropped connection counts as a failed request
+            status = 0
+        samples.append((name, status, start, (time.time() - start) * 1000))
+    return samples
+
+
+def run_worker(url, config_name, username, password, weights, requests, duration, seed):
+    """Entry point of a worker process, it loads ``url`` or an app of its own."""
+    if url:
+        return os.getpid(), play(HTTPClient(url), username, password, weights, requests, duration, seed)
+    from todoism import create_app
+    app = create_app(config_name)
+    try:
+        return os.getpid(), play(WSGIClient(app), username, password, weights, requests, duration, seed)
+    finally:
+        app.extensions['todoism_password_hasher'].shutdown()
+
+
+def summarize(samples):
+    """Aggregate the samples of all workers into throughput, latency histograms and error rates.
+
+    Throughput is measured from the first request to the end of the last one, so the
+    startup of the worker processes doesn't count.
+    """
+    elapsed = (max(start + latency / 1000 for name, status, start, latency in samples) -
+               min(start for name, status, start, latency in samples)) if samples else 0
+    report = {'requests': len(samples), 'elapsed': round(elapsed, 3),
+              'throughput': round(len(samples) / elapsed, 1) if elapsed else 0, 'workloads': {}}
+    by_workload = {}
+    for name, status, start, latency in samples:
+        by_workload.setdefault(name, []).append((status, latency))
+    for name, results in sorted(by_workload.items()):
+        latencies = sorted(latency for status, latency in results)
+        errors = sum(1 for status, latency in results if not 200 <= status < 400)
+        histogram = [0] * len(BUCKETS)
+        for latency in latencies:
+            histogram[next(i for i, bound in enumerate(BUCKETS) if latency <= bound)] += 1
+        report['workloads'][name] = {
+            'requests': len(results),
+            'errors': errors,
+            'error_rate': round(errors / float(len(results)), 4),
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'histogram': dict(zip([str(bound) for bound in BUCKETS], histogram)),
+        }
+    return report
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import glob
+import mmap
+import os
+import struct
+import time
+from functools import lru_cache
+from threading import Lock
+
+from flask import _request_ctx_stack, current_app, request, request_started, request_finished, \
+    request_tearing_down
+
+from todoism.cache import get_identity_cache, get_token_cache, get_fragment_cache
+from todoism.extensions import db
+from todoism.pages import get_page_cache
+
+# name: (type, help), in the order they are exposed
+METRICS = {
+    'todoism_requests_total': ('counter', 'Handled requests by blueprint, endpoint, method and status.'),
+    'todoism_request_duration_seconds': ('histogram', 'Time to the response, by blueprint and endpoint.'),
+    'todoism_requests_in_flight': ('gauge', 'Requests being handled, by blueprint.'),
+    'todoism_auth_failures_total': ('counter', 'Rejected logins, token grants and API tokens, by reason.'),
+    'todoism_cache_hits_total': ('counter', 'Cache hits, by cache.'),
+    'todoism_cache_misses_total': ('counter', 'Cache misses, by cache.'),
+    'todoism_cache_hit_ratio': ('gauge', 'Hits over lookups since the processes started, by cache.'),
+    'todoism_db_pool_size': ('gauge', 'Connections the pools keep open.'),
+    'todoism_db_pool_checked_out': ('gauge', 'Connections in use.'),
+    'todoism_db_pool_overflow': ('gauge', 'Connections opened beyond the pool size.'),
+}
+# describe the state of a process, so the values of exited workers are left out
+LIVE_METRICS = {'todoism_requests_in_flight', 'todoism_db_pool_size', 'todoism_db_pool_checked_out',
+                'todoism_db_pool_overflow'}
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+CACHES = {'identity': get_identity_cache, 'token': get_token_cache, 'fragment': get_fragment_cache,
+          'page': get_page_cache}
+POOL_STATS = {'size': 'todoism_db_pool_size', 'checkedout': 'todoism_db_pool_checked_out',
+              'overflow': 'todoism_db_pool_overflow'}
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def sample(name, **labels):
+    """The key of a sample, which is also how it is written out, e.g. ``name{label="value"}``."""
+    if not labels:
+        return name
+    return '%s{%s}' % (name, ','.join('%s="%s"' % (label, escape(value)) for label, value in sorted(labels.items())))
+
+
+def sample_name(key):
+    name = key.split('{', 1)[0]
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+
+def read_entries(data, used):
+    """Yield the ``(key, offset, value)`` entries of a value file."""
+    offset = 8
+    while offset < used:
+        length = struct.unpack_from('<i', data, offset)[0]
+        key = bytes(data[offset + 4:offset + 4 + length]).decode('utf-8')
+        offset += 4 + length + (-(4 + length) % 8)
+        yield key, offset, struct.unpack_from('<d', data, offset)[0]
+        offset += 8
+
+
+def read_values(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < 8:
+        return []
+    used = min(struct.unpack_from('<i', data, 0)[0], len(data))
+    return [(key, value) for key, offset, value in read_entries(data, used)]
+
+
+class ValueFile(object):
+    """The metric values of one process in a memory-mapped file.
+
+    The file starts with the number of used bytes, followed by entries made of
+    the key length, the key padded to 8 bytes and the value as a double. A new
+    entry is written before the used size is moved past it, so a reader never
+    sees half an entry.
+    """
+
+    def __init__(self, path, size=64 * 1024):
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size < size:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), os.fstat(self._file.fileno()).st_size)
+        self._used = struct.unpack_from('<i', self._map, 0)[0] or 8
+        self._offsets = {}
+        self.values = {}
+        for key, offset, value in read_entries(self._map, self._used):
+            self._offsets[key] = offset
+            self.values[key] = value
+
+    def write(self, key, value):
+        offset = self._offsets.get(key)
+        if offset is None:
+            offset = self._add(key)
+        struct.pack_into('<d', self._map, offset, value)
+
+    def _add(self, key):
+        encoded = key.encode('utf-8')
+        padded = len(encoded) + (-(4 + len(encoded)) % 8)
+        if self._used + 4 + padded + 8 > len(self._map):
+            size = len(self._map) * 2
+            self._map.close()
+            self._file.truncate(size)
+            self._map = mmap.mmap(self._file.fileno(), size)
+        struct.pack_into('<i%ds' % padded, self._map, self._used, len(encoded), encoded)
+        offset = self._used + 4 + padded
+        struct.pack_into('<d', self._map, offset, 0.0)
+        self._used = offset + 8
+        struct.pack_into('<i', self._map, 0, self._used)
+        self._offsets[key] = offset
+        return offset
+
+
+def process_alive(pid):
+    if os.name == 'nt':
+        return True  # os.kill would terminate it
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry(object):
+    """Metric values of this process, exposed together with the values of the other workers.
+
+    Without a directory the values are only kept in memory. With a directory,
+    every process writes its values to a file of its own there, so preforked
+    workers never contend for a lock, and a scrape adds up the files.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._lock = Lock()
+        self._pid = None
+        self._file = None
+        self._values = {}
+
+    def _reset(self):
+        # a forked worker starts from zero, in a file of its own
+        self._pid = os.getpid()
+        self._values = {}
+        self._file = None
+        if self.directory:
+            self._file = ValueFile(os.path.join(self.directory, 'metrics_%d.db' % self._pid))
+            self._values = self._file.values
+
+    def inc(self, key, amount=1):
+        self.update({key: amount})
+
+    def update(self, amounts=None, values=None):
+        """Add ``amounts`` and set ``values``, both dicts of sample keys, under a single lock."""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            for key, amount in (amounts or {}).items():
+                self._write(key, self._values.get(key, 0) + amount)
+            for key, value in (values or {}).items():
+                self._write(key, value)
+
+    def _write(self, key, value):
+        self._values[key] = value
+        if self._file is not None:
+            self._file.write(key, value)
+
+    def collect(self):
+        """Return the values of all processes, summed per sample key."""
+        if not self.directory:
+            with self._lock:
+                return dict(self._values) if self._pid == os.getpid() else {}
+        values = {}
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.db')):
+            alive = process_alive(int(os.path.basename(path)[8:-3]))
+            for key, value in read_values(path):
+                if alive or sample_name(key) not in LIVE_METRICS:
+                    values[key] = values.get(key, 0) + value
+        return values
+
+
+def render(values):
+    """Render the values in the Prometheus text format."""
+    for cache in CACHES:
+        hits = values.get(sample('todoism_cache_hits_total', cache=cache), 0)
+        misses = values.get(sample('todoism_cache_misses_total', cache=cache), 0)
+        if hits + misses:
+            values[sample('todoism_cache_hit_ratio', cache=cache)] = hits / (hits + misses)
+    families = {name: [] for name in METRICS}
+    # dicts keep the order the samples were first written in, which puts the buckets in order
+    for key, value in values.items():
+        families.setdefault(sample_name(key), []).append('%s %r' % (key, float(value)))
+    lines = []
+    for name, samples in families.items():
+        if samples and name in METRICS:
+            lines.append('# HELP %s %s' % (name, METRICS[name][1]))
+            lines.append('# TYPE %s %s' % (name, METRICS[name][0]))
+            lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+@lru_cache(maxsize=1024)
+def duration_keys(blueprint, endpoint):
+    labels = dict(blueprint=blueprint, endpoint=endpoint)
+    buckets = [(bound, sample('todoism_request_duration_seconds_bucket', le='%g' % bound if bound != float('inf')
+                              else '+Inf', **labels)) for bound in BUCKETS]
+    return (buckets, sample('todoism_request_duration_seconds_sum', **labels),
+            sample('todoism_request_duration_seconds_count', **labels))
+
+
+def get_registry():
+    return current_app.extensions['todoism_metrics']
+
+
+def count_auth_failure(reason):
+    registry = current_app.extensions.get('todoism_metrics')
+    if registry is not None:
+        registry.inc(sample('todoism_auth_failures_total', reason=reason))
+
+
+def process_stats():
+    """Cache counters and pool gauges of this process, written after every request."""
+    values = {}
+    for name, get_cache in CACHES.items():
+        cache = get_cache()
+        values[sample('todoism_cache_hits_total', cache=name)] = cache.hits
+        values[sample('todoism_cache_misses_total', cache=name)] = cache.misses
+    pool = db.engine.pool
+    for method, name in POOL_STATS.items():
+        # only the queue pool has all of them, SQLite gets a simpler pool
+        if hasattr(pool, method):
+            values[sample(name)] = getattr(pool, method)()
+    return values
+
+
+def start_request(app, **extra):
+    ctx = _request_ctx_stack.top
+    ctx.todoism_metrics = [time.perf_counter(), False]
+    app.extensions['todoism_metrics'].inc(sample('todoism_requests_in_flight', blueprint=request.blueprint or ''))
+
+
+def observe_request(app, status):
+    started, observed = _request_ctx_stack.top.todoism_metrics
+    _request_ctx_stack.top.todoism_metrics[1] = True
+    latency = time.perf_counter() - started
+    blueprint, endpoint = request.blueprint or '', request.endpoint or ''
+    buckets, sum_key, count_key = duration_keys(blueprint, endpoint)
+    # every bucket is written, so that all of them exist in order from the first request on
+    amounts = {key: int(latency <= bound) for bound, key in buckets}
+    amounts[sum_key] = latency
+    amounts[count_key] = 1
+    amounts[sample('todoism_requests_total', blueprint=blueprint, endpoint=endpoint, method=request.method,
+                   status=status)] = 1
+    app.extensions['todoism_metrics'].update(amounts)
+
+
+def finish_request(app, response, **extra):
+    if getattr(_request_ctx_stack.top, 'todoism_metrics', None) is not None:
+        observe_request(app, response.status_code)
+
+
+def tear_down_request(app, **extra):
+    state = getattr(_request_ctx_stack.top, 'todoism_metrics', None)
+    if state is None:
+        return
+    if not state[1]:
+        observe_request(app, 500)  # an exception escaped, no response was made
+    app.extensions['todoism_metrics'].update(
+        {sample('todoism_requests_in_flight', blueprint=request.blueprint or ''): -1}, process_stats())
+
+
+def init_metrics(app):
+    if not app.config['TODOISM_METRICS']:
+        return
+    app.extensions['todoism_metrics'] = Registry(app.config['TODOISM_METRICS_DIR'])
+    request_started.connect(start_request, app)
+    request_finished.connect(finish_request, app)
+    request_tearing_down.connect(tear_down_request, app)
@@ -5,10 +5,15 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
+from datetime import datetime
+
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event
 
+from todoism.cache import forget_identity
 from todoism.extensions import db
+from todoism.instrument import timed
+from todoism.passwords import get_hasher
 
 
 class User(db.Model, UserMixin):
@@ -16,18 +21,188 @@ class User(db.Model, UserMixin):
     username = db.Column(db.String(20), unique=True, index=True)
     password_hash = db.Column(db.String(128))
     locale = db.Column(db.String(20))
-    items = db.relationship('Item', back_populates='author', cascade='all')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # demo accounts expire and are deleted by the reaper, regular accounts never expire
+    expires_at = db.Column(db.DateTime, index=True)
+    # denormalized counters, kept in sync by every item mutation
+    all_item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    active_item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    completed_item_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # bumped by every item mutation, used as the validator of conditional requests
+    item_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    items_updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # tombstones up to this version were compacted, older sync points must fetch everything again
+    compacted_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # set while a pre-generated demo account waits in the pool, cleared when /register claims it
+    pool_locale = db.Column(db.String(20), index=True)
+    demo_password = db.Column(db.String(32))
+    # items are removed by the ON DELETE CASCADE of item.author_id instead of being loaded one by one
+    items = db.relationship('Item', back_populates='author', cascade='all', passive_deletes=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = get_hasher().hash(password)
 
+    @timed('auth')
     def validate_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Check the password, and upgrade the hash if the configured parameters changed since it was made."""
+        hasher = get_hasher()
+        if not hasher.verify(self.password_hash, password):
+            return False
+        if hasher.needs_rehash(self.password_hash):
+            self.set_password(password)  # committed by the login view
+        return True
+
+    @property
+    def expired(self):
+        return self.expires_at is not None and self.expires_at < datetime.utcnow()
+
+    def bump_item_version(self):
+        """Bump the item version inside the current transaction, which locks the user row until it ends.
+
+        Every item mutation calls this exactly once, before it changes any item,
+        and stamps the changed rows with :meth:`item_version_stamp`. Mutations of
+        the same user are serialized by the row lock, so two transactions never
+        stamp their changes with the same version.
+        """
+        User.query.filter_by(id=self.id).update({
+            User.item_version: User.item_version + 1,
+            User.items_updated_at: datetime.utcnow(),
+        }, synchronize_session=False)
+        db.session.expire(self, ['item_version', 'items_updated_at'])
+
+    def item_version_stamp(self):
+        """SQL expression for the version bumped by this transaction, to stamp the changed rows with."""
+        return db.select([User.item_version]).where(User.id == self.id).as_scalar()
+
+    def update_item_stats(self, active=0, completed=0):
+        """Shift the item counters inside the current transaction, after :meth:`bump_item_version`."""
+        if not active and not completed:
+            return
+        User.query.filter_by(id=self.id).update({
+            User.all_item_count: User.all_item_count + active + completed,
+            User.active_item_count: User.active_item_count + active,
+            User.completed_item_count: User.completed_item_count + completed,
+        }, synchronize_session=False)
+        db.session.expire(self, ['all_item_count', 'active_item_count', 'completed_item_count'])
+
+    def owned_items(self, item_id=None, base_version=None):
+        """Query own items, optionally one item that was not changed since ``base_version``."""
+        query = Item.query.filter_by(author_id=self.id)
+        if item_id is not None:
+            query = query.filter_by(id=item_id)
+        if base_version is not None:
+            query = query.filter(Item.version <= base_version)
+        return query
+
+    def bury_items(self, query):
+        """Leave a tombstone for every item the query matches, call it right before deleting them."""
+        select = query.with_entities(Item.id, Item.author_id, self.item_version_stamp(),
+                                     db.literal(datetime.utcnow(), db.DateTime)).statement
+        db.session.execute(Tombstone.__table__.insert().from_select(
+            ['item_id', 'author_id', 'version', 'deleted_at'], select))
+
+    def clear_items(self):
+        """Delete all completed items with one statement, return the number of deleted items."""
+        self.bump_item_version()
+        self.bury_items(self.owned_items().filter_by(done=True))
+        count = self.owned_items().filter_by(done=True).delete(synchronize_session='evaluate')
+        if count:
+            self.update_item_stats(completed=-count)
+            db.session.expire(self, ['items'])
+        return count
+
+    def mark_items(self, done):
+        """Mark all items as done or active with one statement, return the number of changed items."""
+        self.bump_item_version()
+        count = self.owned_items().filter_by(done=not done).update(
+            {'done': done, 'version': self.item_version_stamp()}, synchronize_session=False)
+        if count:
+            if done:
+                self.update_item_stats(active=-count, completed=count)
+            else:
+                self.update_item_stats(active=count, completed=-count)
+            for obj in list(db.session.identity_map.values()):
+                if isinstance(obj, Item):
+                    db.session.expire(obj, ['done', 'version'])
+        return count
+
+    def edit_item(self, item_id, body, base_version=None):
+        """Update the body of an own item with one scoped UPDATE, return False if no item matched."""
+        self.bump_item_version()
+        return bool(self.owned_items(item_id, base_version).update(
+            {'body': body, 'version': self.item_version_stamp()}, synchronize_session=False))
+
+    def toggle_item(self, item_id, base_version=None):
+        """Flip ``done`` of an own item in SQL, return the new state or None if no item matched."""
+        self.bump_item_version()
+        if not self.owned_items(item_id, base_version).update(
+                {'done': ~Item.done, 'version': self.item_version_stamp()}, synchronize_session=False):
+            return None
+        # the row is locked by our UPDATE, so this read can't race with another toggle
+        done = db.session.query(Item.done).filter_by(id=item_id).scalar()
+        if done:
+            self.update_item_stats(active=-1, completed=1)
+        else:
+            self.update_item_stats(active=1, completed=-1)
+        return done
+
+    def delete_item(self, item_id, base_version=None):
+        """Delete an own item with scoped DELETEs, return False if no item matched."""
+        self.bump_item_version()
+        # conditioning on ``done`` tells which counter to decrement without reading the row first
+        for done in (False, True):
+            if self.owned_items(item_id, base_version).filter_by(done=done).delete(synchronize_session=False):
+                db.session.add(Tombstone(item_id=item_id, author_id=self.id, version=self.item_version_stamp()))
+                if done:
+                    self.update_item_stats(completed=-1)
+                else:
+                    self.update_item_stats(active=-1)
+                return True
+        return False
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def forget_user(mapper, connection, user):
+    # a changed password or locale, or a deleted account, must not be served from the identity cache
+    forget_identity(user.id)
 
 
 class Item(db.Model):
+    __table_args__ = (
+        db.Index('ix_item_author_id_done', 'author_id', 'done'),
+        db.Index('ix_item_author_id_version', 'author_id', 'version'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     done = db.Column(db.Boolean, default=False)
-    author_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), index=True)
     author = db.relationship('User', back_populates='items')
+
+    @classmethod
+    def exists(cls, item_id):
+        return db.session.query(cls.query.filter_by(id=item_id).exists()).scalar()
+
+
+class Tombstone(db.Model):
+    """Records a deleted item so that clients can sync deletions, compacted after a retention period."""
+    __table_args__ = (db.Index('ix_tombstone_author_id_version', 'author_id', 'version'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+
+
+class RefreshToken(db.Model):
+    """A revocable refresh token, only the SHA-256 digest of its secret is stored."""
+    id = db.Column(db.Integer, primary_key=True)
+    token_hash = db.Column(db.String(64), unique=True, index=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked = db.Column(db.Boolean, nullable=False, default=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import glob
+import hashlib
+import os
+import time
+from functools import wraps
+
+from flask import current_app, request
+from flask_babel import get_locale
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+
+from todoism.cache import LRUCache
+
+# rendered in place of the CSRF token of cached pages, replaced for every response
+CSRF_PLACEHOLDER = '__todoism_csrf_token__'
+
+
+class PageCache(LRUCache):
+    """Caches rendered pages as ``(etag, body)`` pairs, dropped when the compiled translations change."""
+
+    def __init__(self, maxsize, translations_path, check_interval=10):
+        super(PageCache, self).__init__(maxsize)
+        self.translations_path = translations_path
+        self.check_interval = check_interval
+        self._stamp = self._translations_stamp()
+        self._checked_at = time.time()
+
+    def _translations_stamp(self):
+        pattern = os.path.join(self.translations_path, '*', 'LC_MESSAGES', '*.mo')
+        return max([os.path.getmtime(path) for path in glob.glob(pattern)] or [0])
+
+    def check_translations(self):
+        # a stat per locale, at most once every check_interval seconds
+        if time.time() - self._checked_at < self.check_interval:
+            return
+        self._checked_at = time.time()
+        stamp = self._translations_stamp()
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self.clear()
+
+    def render(self, key, render):
+        """Return the ``(etag, body)`` of a page, calling ``render()`` only if it isn't cached."""
+        self.check_translations()
+        page = self.get(key)
+        if page is None:
+            body = render()
+            page = (hashlib.md5(body.encode('utf-8')).hexdigest(), body)
+            self.set(key, page)
+        return page
+
+
+def init_page_cache(app):
+    app.extensions['todoism_page_cache'] = PageCache(app.config['TODOISM_PAGE_CACHE_SIZE'],
+                                                     os.path.join(app.root_path, 'translations'))
+
+
+def get_page_cache():
+    return current_app.extensions['todoism_page_cache']
+
+
+def cached_page(csrf=False):
+    """Serve the page an anonymous visitor gets from the page cache, keyed by endpoint and locale.
+
+    The view must return the rendered HTML for a GET from an anonymous
+    visitor, other requests are passed through. Cached pages are answered with
+    an ETag and revalidated by the browser. Pages with ``csrf`` render
+    :data:`CSRF_PLACEHOLDER` instead of the token, a fresh token is put in
+    for every response, and such pages are never answered with a 304.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or current_user.is_authenticated or \
+                    not current_app.config['TODOISM_PAGE_CACHE']:
+                rv = f(*args, **kwargs)
+                return rv.replace(CSRF_PLACEHOLDER, generate_csrf()) if csrf else rv
+
+            key = (request.endpoint, tuple(sorted(request.view_args.items())), str(get_locale()))
+            etag, body = get_page_cache().render(key, lambda: f(*args, **kwargs))
+            response = current_app.response_class(mimetype='text/html')
+            response.vary.update(('Cookie', 'Accept-Language'))
+            response.cache_control.no_cache = True
+            if csrf:
+                response.set_data(body.replace(CSRF_PLACEHOLDER, generate_csrf()))
+                return response
+            response.set_data(body)
+            response.set_etag(etag)
+            return response.make_conditional(request)
+        return decorated_function
+    return decorator
+
+
+def render_cached(key, render):
+    """Render a page that is the same for every visitor through the page cache, return its body."""
+    if not current_app.config['TODOISM_PAGE_CACHE']:
+        return render()
+    return get_page_cache().render(key + (str(get_locale()),), render)[1]
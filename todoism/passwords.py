@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+    :author: Grey Li (李辉)
+    :url: http://greyli.com
+    :copyright: © 2018 Grey Li <withlihui@gmail.com>
+    :license: MIT, see LICENSE for more details.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from threading import BoundedSemaphore, Lock
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+
+def effective_method(method):
+    """The method as Werkzeug writes it into a hash, ``pbkdf2:sha256`` becomes ``pbkdf2:sha256:150000``."""
+    if not method.startswith('pbkdf2:'):
+        return method
+    args = method[7:].split(':')
+    iterations = len(args) > 1 and int(args[1] or 0) or DEFAULT_PBKDF2_ITERATIONS
+    return 'pbkdf2:%s:%d' % (args[0], iterations)
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool is saturated, it is answered with a 503."""
+
+
+class PasswordHasher(object):
+    """Runs PBKDF2 hashing and verification in a bounded process pool.
+
+    At most ``workers + queue_size`` calls are in flight per process, any
+    further call fails fast with :class:`HashingBusy` instead of queueing, so
+    a login storm can't tie up the request threads. With ``workers=0`` the
+    work is done inline on the request thread.
+    """
+
+    def __init__(self, method, workers=0, queue_size=0, timeout=None):
+        self.method = method
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = BoundedSemaphore(workers + queue_size) if workers else None
+        self._executor = None
+        self._pid = None
+        self._lock = Lock()
+
+    def _get_executor(self):
+        # the pool is created lazily and again after a fork, a forked child can't use its parent's pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def shutdown(self):
+        """Stop the pool, a process that exits with a live pool waits for its workers forever."""
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # the slot is freed when the work is done, a call that timed out keeps it while it still runs
+        future.add_done_callback(lambda future: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HashingBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Tell if a hash was made with other parameters than the configured ones."""
+        return password_hash.split('$', 1)[0] != effective_method(self.method)
+
+
+def init_hasher(app):
+    app.extensions['todoism_password_hasher'] = PasswordHasher(
+        app.config['TODOISM_PASSWORD_HASH_METHOD'],
+        workers=app.config['TODOISM_HASH_WORKERS'],
+        queue_size=app.config['TODOISM_HASH_QUEUE_SIZE'],
+        timeout=app.config['TODOISM_HASH_TIMEOUT'])
+
+
+def get_hasher():
+    return current_app.extensions['todoism_password_hasher']
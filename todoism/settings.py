@@ -13,6 +13,59 @@ basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
 class BaseConfig:
     TODOISM_LOCALES = ['en_US', 'zh_Hans_CN']
     TODOISM_ITEM_PER_PAGE = 20
+    TODOISM_ITEM_MAX_PER_PAGE = 100
+    TODOISM_APP_WINDOW_SIZE = 50  # items rendered by /app, the rest is loaded on scroll
+    TODOISM_CLIENT_RENDERING = False  # build new items in the browser, the todo views only return JSON
+    TODOISM_FAST_JSON = True  # only takes effect when orjson is installed
+    TODOISM_BATCH_LIMIT = 500
+    TODOISM_IMPORT_BATCH_SIZE = 1000
+    TODOISM_TOMBSTONE_RETENTION_DAYS = 30
+    TODOISM_REFRESH_TOKEN_DAYS = 30
+    # Werkzeug hash method with an explicit iteration count, changing it upgrades hashes on the next login
+    TODOISM_PASSWORD_HASH_METHOD = 'pbkdf2:sha256:150000'
+    TODOISM_HASH_WORKERS = 2  # 0 hashes on the request thread
+    TODOISM_HASH_QUEUE_SIZE = 8
+    TODOISM_HASH_TIMEOUT = 10
+    # per-process cache of user identities and verified tokens, a size of 0 disables it
+    TODOISM_IDENTITY_CACHE_SIZE = 10000
+    TODOISM_IDENTITY_CACHE_TTL = 60
+    TODOISM_DEMO_POOL_SIZE = 50
+    TODOISM_DEMO_ACCOUNT_DAYS = 7
+    TODOISM_REAP_CHUNK_SIZE = 200
+    TODOISM_PAGE_CACHE = True
+    TODOISM_PAGE_CACHE_SIZE = 256
+    TODOISM_FRAGMENT_CACHE_SIZE = 100000
+    TODOISM_FRAGMENT_CACHE_CHARS = 64 * 1024 * 1024
+    # per-request query count and timings, sent in a Server-Timing header and logged by todoism.instrument
+    TODOISM_INSTRUMENT = os.getenv('TODOISM_INSTRUMENT') == '1'
+    # Prometheus metrics at /metrics, served to scrapers sending this token, or to localhost if allowed
+    TODOISM_METRICS = True
+    TODOISM_METRICS_TOKEN = os.getenv('TODOISM_METRICS_TOKEN')
+    TODOISM_METRICS_ALLOW_LOCALHOST = False  # don't turn it on behind a reverse proxy on the same host
+    # where preforked workers keep their metrics, empty it before the server starts; unset keeps them in memory
+    TODOISM_METRICS_DIR = os.getenv('TODOISM_METRICS_DIR')
+    # most queries an endpoint may run, exceeding it fails the request in testing and logs a warning otherwise
+    TODOISM_QUERY_LIMITS = {
+        'auth.login': 4,
+        'home.set_locale': 2,
+        'todo.app': 4,
+        'todo.items': 3,
+        'todo.new_item': 6,
+        'todo.edit_item': 4,
+        'todo.toggle_item': 7,
+        'todo.delete_item': 6,
+        'todo.clear_items': 6,
+        'todo.complete_items': 6,
+        'todo.activate_items': 6,
+        'api_v1.token': 4,
+        'api_v1.revoke_token': 3,
+        'api_v1.user': 2,
+        'api_v1.item': 6,
+        'api_v1.items': 6,
+        'api_v1.active_items': 3,
+        'api_v1.completed_items': 4,
+        'api_v1.item_changes': 3,
+    }
 
     BABEL_DEFAULT_LOCALE = TODOISM_LOCALES[0]
 
@@ -35,10 +88,21 @@ class TestingConfig(BaseConfig):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///'
     WTF_CSRF_ENABLED = False
+    TODOISM_PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    TODOISM_HASH_WORKERS = 0
+    TODOISM_INSTRUMENT = True
+
+
+class BenchmarkConfig(BaseConfig):
+    # production settings, hashing included, on an in-memory database without instrumentation
+    SQLALCHEMY_DATABASE_URI = 'sqlite:///'
+    WTF_CSRF_ENABLED = False
+    TODOISM_INSTRUMENT = False
 
 
 config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
-    'testing': TestingConfig
+    'testing': TestingConfig,
+    'benchmark': BenchmarkConfig
 }
@@ -52,7 +52,9 @@ $(document).ready(function () {
             url: url,
             success: function (data) {
                 $('#main').hide().html(data).fadeIn(800);
+                item_filter = 'all';
                 activeM();
+                load_more_items();
             }
         });
     });
@@ -75,8 +77,9 @@ $(document).ready(function () {
     $(document).on('click', '#toggle-password', toggle_password);
 
     function display_dashboard() {
-        var all_count = $('.item').length;
-        if (all_count === 0) {
+        // the counters come from the server, only a window of the items may be loaded
+        var all_count = parseInt($('#all-count').text(), 10);
+        if (!all_count) {
             $('#dashboard').hide();
         } else {
             $('#dashboard').show();
@@ -107,23 +110,112 @@ $(document).ready(function () {
         $input.focus();
     }
 
-    function refresh_count() {
+    function refresh_count(counts) {
+        $('#all-count').html(counts.all);
+        $('#active-count').html(counts.active);
+        $('#active-count-nav').html(counts.active);
+        $('#completed-count').html(counts.completed);
+        display_dashboard();
+    }
+
+    var item_filter = 'all';
+
+    function filter_items() {
         var $items = $('.item');
 
-        display_dashboard();
-        var all_count = $items.length;
-        var active_count = $items.filter(function () {
-            return $(this).data('done') === false;
-        }).length;
-        var completed_count = $items.filter(function () {
-            return $(this).data('done') === true;
-        }).length;
-        $('#all-count').html(all_count);
-        $('#active-count').html(active_count);
-        $('#active-count-nav').html(active_count);
-        $('#completed-count').html(completed_count);
+        $items.show();
+        if (item_filter === 'active') {
+            $items.filter(function () {
+                return $(this).data('done');
+            }).hide();
+        } else if (item_filter === 'completed') {
+            $items.filter(function () {
+                return !$(this).data('done');
+            }).hide();
+        }
+    }
+
+    function build_item(item) {
+        // fill a copy of the item template that /app renders once in client rendering mode
+        var $item = $($.parseHTML($('#item-template').html().trim())).filter('.item');
+        var with_id = function (url) {
+            return url.replace('/0/', '/' + item.id + '/');
+        };
+        $item.attr('data-href', with_id($item.attr('data-href')))
+            .attr('data-id', item.id)
+            .attr('data-body', item.body)
+            .attr('data-done', JSON.stringify(item.done));
+        $item.find('.done-btn, .delete-btn').each(function () {
+            $(this).attr('data-href', with_id($(this).attr('data-href')));
+        });
+        var $body = $item.find('#body0').attr('id', 'body' + item.id).text(item.body);
+        if (item.done) {
+            $item.find('.done-btn i').text('check_box');
+            $body.removeClass('active-item').addClass('inactive-item');
+        }
+        return $item;
     }
 
+    function parse_items(data) {
+        // the todo views return either rendered HTML or item data for build_item()
+        if (data.html !== undefined) {
+            return $($.parseHTML(data.html.trim())).filter('.item');
+        }
+        var items = data.items || [data.item];
+        return $($.map(items, function (item) {
+            return build_item(item).get();
+        }));
+    }
+
+    function insert_items($items) {
+        // skip items that were already added on this page, and keep the items in id order
+        var $new_items = $items.filter(function () {
+            return $('.item[data-id="' + $(this).data('id') + '"]').length === 0;
+        });
+        if ($new_items.length === 0) {
+            return;
+        }
+        var first_id = $new_items.first().data('id');
+        var $later = $('.items .item').filter(function () {
+            return $(this).data('id') > first_id;
+        }).first();
+        if ($later.length) {
+            $later.before($new_items);
+        } else {
+            $('.items').append($new_items);
+        }
+    }
+
+    var loading_items = false;
+
+    function load_more_items() {
+        var $items = $('.items');
+        var next_url = $items.data('next');
+        if (loading_items || !next_url) {
+            return;
+        }
+        if ($(window).scrollTop() + $(window).height() < $(document).height() - 200) {
+            return;
+        }
+        loading_items = true;
+        $.ajax({
+            type: 'GET',
+            url: next_url,
+            success: function (data) {
+                insert_items(parse_items(data));
+                $items.data('next', data.next || '');
+                filter_items();
+            },
+            complete: function () {
+                loading_items = false;
+                // keep loading until the page can scroll
+                load_more_items();
+            }
+        });
+    }
+
+    $(window).on('scroll', load_more_items);
+
     function new_item(e) {
         var $input = $('#item-input');
         var value = $input.val().trim();
@@ -138,9 +230,9 @@ $(document).ready(function () {
             contentType: 'application/json;charset=UTF-8',
             success: function (data) {
                 M.toast({html: data.message, classes: 'rounded'});
-                $('.items').append(data.html);
+                insert_items(parse_items(data));
                 activeM();
-                refresh_count();
+                refresh_count(data.counts);
             }
         });
     }
@@ -198,7 +290,7 @@ $(document).ready(function () {
                     $this.find('i').text('check_box_outline_blank');
                     $item.data('done', false);
                     M.toast({html: data.message});
-                    refresh_count();
+                    refresh_count(data.counts);
                 }
             })
         } else {
@@ -211,7 +303,7 @@ $(document).ready(function () {
                     $this.find('i').text('check_box');
                     $item.data('done', true);
                     M.toast({html: data.message});
-                    refresh_count();
+                    refresh_count(data.counts);
                 }
             })
 
@@ -273,7 +365,7 @@ $(document).ready(function () {
             success: function (data) {
                 $item.remove();
                 activeM();
-                refresh_count();
+                refresh_count(data.counts);
                 M.toast({html: data.message});
             }
         });
@@ -347,30 +439,21 @@ $(document).ready(function () {
 
 
     $(document).on('click', '#active-item', function () {
-        var $input = $('#item-input');
-        var $items = $('.item');
-
-        $input.focus();
-        $items.show();
-        $items.filter(function () {
-            return $(this).data('done');
-        }).hide();
+        $('#item-input').focus();
+        item_filter = 'active';
+        filter_items();
     });
 
     $(document).on('click', '#completed-item', function () {
-        var $input = $('#item-input');
-        var $items = $('.item');
-
-        $input.focus();
-        $items.show();
-        $items.filter(function () {
-            return !$(this).data('done');
-        }).hide();
+        $('#item-input').focus();
+        item_filter = 'completed';
+        filter_items();
     });
 
     $(document).on('click', '#all-item', function () {
         $('#item-input').focus();
-        $('.item').show();
+        item_filter = 'all';
+        filter_items();
     });
 
     $(document).on('click', '#clear-btn', function () {
@@ -386,7 +469,7 @@ $(document).ready(function () {
                     return $(this).data('done');
                 }).remove();
                 M.toast({html: data.message, classes: 'rounded'});
-                refresh_count();
+                refresh_count(data.counts);
             }
         });
     });